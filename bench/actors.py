@@ -0,0 +1,91 @@
+'''Benchmark for loading actor rows from a save file. Builds a synthetic save
+with lots of actors and compares the old one query per actor loader with
+mapload.fetch_actors, with and without indexes.
+
+Usage: python -m bench.actors [actors] [properties_per_actor]
+'''
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+
+from game import headless
+from game import mapload
+from game.database import Database
+from bench.synthetic import SCHEMA
+
+def make_save(filename, count, properties):
+    '''Writes a save with count actors on map 1, a few on map 2, and the
+    given number of properties per actor.
+    '''
+    db = sqlite3.connect(filename)
+    for sql in SCHEMA:
+        db.execute(sql)
+    db.execute("INSERT INTO map (name, file) VALUES ('Big', 'maps/outside.tmx')")
+    db.execute("INSERT INTO map (name, file) VALUES ('Small', 'maps/inn.tmx')")
+    actors = []
+    props = []
+    for i in range(count + 10):
+        mapnum = 1 if i < count else 2
+        actors.append((i, mapnum, 'npc', 'NPC %d' % i, 'Test', i % 1000, i // 1000, 24, 24))
+        for p in range(properties):
+            props.append((i, 'property%d' % p, 'value %d' % i))
+    db.executemany('INSERT INTO actor VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', actors)
+    db.executemany('INSERT INTO actor_property (actornum, property, value) VALUES (?, ?, ?)', props)
+    db.commit()
+    db.close()
+
+def fetch_actors_per_row(db, mapnum):
+    '''The loader as it was before fetch_actors grouped its queries.'''
+    cursor = db.connection.cursor()
+    cursor.execute('SELECT actornum, type, name, group_name, x, y, width,\
+            height FROM actor WHERE mapnum=?', (mapnum,))
+    actors = []
+    for row in cursor:
+        property_cursor = db.connection.cursor()
+        property_cursor.execute('SELECT property, value FROM actor_property\
+            WHERE actornum=?', (row['actornum'],))
+        properties = {}
+        for property_row in property_cursor:
+            properties[property_row['property']] = property_row['value']
+        actors.append((row, properties))
+    return actors
+
+def time_it(func, db, mapnum, repeat=3):
+    # Best of a few runs so the first run's cold page cache doesn't count
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        actors = func(db, mapnum)
+        elapsed = time.time() - start
+        if best == None or elapsed < best:
+            best = elapsed
+    return best, len(actors)
+
+def main(count=10000, properties=2):
+    headless.init()
+    handle, filename = tempfile.mkstemp(suffix='.save')
+    os.close(handle)
+    os.remove(filename)
+    try:
+        make_save(filename, count, properties)
+        db = Database(filename)
+
+        print '%-10s %-12s %10s %10s' % ('indexes', 'loader', 'actors', 'time (s)')
+        for indexed in (False, True):
+            if indexed:
+                db.execute('create_actor_index')
+                db.execute('create_actor_property_index')
+            # The per row loader is quadratic without indexes
+            if indexed or count <= 2000:
+                t, n = time_it(fetch_actors_per_row, db, 1)
+                print '%-10s %-12s %10d %10.4f' % (indexed, 'per row', n, t)
+            t, n = time_it(mapload.fetch_actors, db, 1)
+            print '%-10s %-12s %10d %10.4f' % (indexed, 'grouped', n, t)
+        db.close()
+    finally:
+        os.remove(filename)
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
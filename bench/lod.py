@@ -0,0 +1,85 @@
+'''Simulation level of detail. Writes a large synthetic map with a few walls,
+puts a focus in the middle and fills the map with wandering NPCs, then
+reports how long a tick takes for each NPC count with every NPC simulated
+in full and with the LOD bands from rpg.conf.
+
+Usage: python -m bench.lod [map_size] [ticks]
+'''
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+from game import headless
+headless.init()
+
+import pyglet
+from game.game import game
+from game import mapload
+from game.actor import actor
+from bench import synthetic
+from bench.simulation import populate
+
+NPC_COUNTS = (250, 500, 1000, 2000, 4000, 8000)
+NEAR = 640
+FAR = 1600
+TICK = 1.0 / 60
+
+def time_ticks(count, ticks, bands):
+    random.seed(count)
+    mapload.map_cache.clear()
+    map_scene = mapload.load_map('Bench 1')
+    map_scene.set_tick_rate(60)
+    map_scene.actors.lod.set_bands(*bands)
+    populate(map_scene, count)
+
+    focus = actor.Actor()
+    focus.name = 'Focus'
+    collision_map = map_scene.collision_map
+    focus.position = (collision_map.width * collision_map.tile_width // 2,
+            collision_map.height * collision_map.tile_height // 2)
+    map_scene.actors.add_actor(focus)
+    map_scene.focus = focus
+
+    # Let everyone settle into their bands first
+    map_scene.update(TICK)
+    start = time.time()
+    for i in range(ticks):
+        map_scene.actors.begin_tick()
+        map_scene.update(TICK)
+        map_scene.actors.interpolate(1.0)
+    elapsed = time.time() - start
+
+    lod = map_scene.actors.lod
+    levels = [0, 0, 0]
+    for level in lod.levels.values():
+        levels[level] += 1
+    return elapsed / ticks, levels
+
+def main(size=256, ticks=60):
+    directory = tempfile.mkdtemp()
+    try:
+        os.mkdir(os.path.join(directory, 'maps'))
+        synthetic.write_map(os.path.join(directory, 'maps', 'bench_1.tmx'), size,
+                objects=0, walls=0.02)
+        save = os.path.join(directory, 'bench.save')
+        synthetic.make_save(save, 1, 0)
+        pyglet.resource.path.append(directory)
+        pyglet.resource.reindex()
+        game.load_db(save)
+
+        print '%dx%d tile map, bands at %d and %d pixels' % (size, size, NEAR, FAR)
+        print '%8s %12s %12s %24s' % ('npcs', 'full ms', 'lod ms', 'full/coarse/far')
+        for count in NPC_COUNTS:
+            full, levels = time_ticks(count, ticks, (None, None))
+            lod, levels = time_ticks(count, ticks, (NEAR, FAR))
+            print '%8d %12.3f %12.3f %24s' % (count, full * 1000, lod * 1000,
+                    '%d/%d/%d' % tuple(levels))
+        game.db.close()
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,222 @@
+'''Map loading benchmark. Generates synthetic maps and a save file of the
+given size and times each stage of mapload.load_map on its own, followed by
+whole cold load_map calls:
+
+    sql_map          looking the map up in the save file
+    sql_actors       fetching actor rows and properties
+    xml_parse        parsing the tmx file
+    layer_decode     decoding the layers' gids
+    collision        building the collision map
+    objects          reading the object layers
+    tileset_slicing  slicing tileset images, only with --gl
+    cells            creating every RectCell of every layer
+    actor_factories  creating the actors of the object layers and the save
+    load_map         the whole thing, starting from an empty map cache
+
+Results are printed as JSON with the median, fastest and slowest run of
+every stage in seconds, and a readable table goes to stderr. Pass the JSON
+of an earlier run to --compare to flag stages that got slower, in which case
+the exit status is 1.
+
+Usage: python -m bench.maploading [--maps N] [--size TILES] [--actors N]
+           [--properties N] [--repeat N] [--gl] [--output FILE]
+           [--compare FILE] [--threshold FRACTION]
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Map loading benchmark')
+    parser.add_argument('--maps', type=int, default=2)
+    parser.add_argument('--size', type=int, default=128, help='map size in tiles')
+    parser.add_argument('--actors', type=int, default=500, help='actors per map')
+    parser.add_argument('--properties', type=int, default=2, help='properties per actor')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--gl', action='store_true',
+            help='open a hidden window so that tileset slicing can be timed')
+    parser.add_argument('--output', help='write the JSON results here instead of stdout')
+    parser.add_argument('--compare', help='JSON results of an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.2,
+            help='how much slower a stage may get before it counts as a regression')
+    return parser.parse_args(argv)
+
+args = parse_args(sys.argv[1:])
+
+# Tileset slicing needs an OpenGL context, everything else runs headless
+if not args.gl:
+    from game import headless
+    headless.init()
+
+import pyglet
+from game.game import game
+from game import mapload
+from game.map import mapscene
+from game.map.collision import CollisionMap
+from game.actor import actor
+from game.util import resource
+from bench import synthetic
+
+STAGES = ('sql_map', 'sql_actors', 'xml_parse', 'layer_decode', 'collision',
+        'objects', 'tileset_slicing', 'cells', 'actor_factories', 'load_map')
+
+class Timer(object):
+    def __init__(self):
+        # Stage name -> list of run times
+        self.runs = dict((stage, []) for stage in STAGES)
+
+    def time(self, stage, func, *args):
+        start = time.time()
+        result = func(*args)
+        self.runs[stage].append(time.time() - start)
+        return result
+
+    def results(self):
+        stages = {}
+        for stage in STAGES:
+            runs = sorted(self.runs[stage])
+            if not runs:
+                stages[stage] = None
+                continue
+            stages[stage] = {'median': runs[len(runs) // 2], 'min': runs[0],
+                    'max': runs[-1], 'runs': len(runs)}
+        return stages
+
+def build_cells(layer_data):
+    # Every cell rather than just the ones around the view, so the numbers
+    # don't depend on the window size
+    layer = mapload.load_layer(layer_data, range(1, 1024), 32, 32)
+    size = layer.chunk_size
+    for ci in range((layer.width + size - 1) // size):
+        for cj in range((layer.height + size - 1) // size):
+            layer.get_chunk(ci, cj)
+    return layer
+
+def build_actors(data, rows):
+    layers = [mapload.load_actor_layer(group) for group in data.object_groups]
+    layer = mapscene.ActorLayer('actors')
+    mapload.load_from_db(layer, data.mapnum, rows)
+    return layers, layer
+
+def run_stages(timer, mapname):
+    mapnum, filename = timer.time('sql_map', mapload.lookup_map, game.db, mapname)
+    rows = timer.time('sql_actors', mapload.fetch_actors, game.db, mapnum)
+
+    path = resource.resource_path(filename)
+    root = timer.time('xml_parse', mapload.ElementTree.parse, path).getroot()
+    data = mapload.MapData(mapname, mapnum, filename, os.path.getmtime(path))
+    data.width = int(root.get('width'))
+    data.height = int(root.get('height'))
+    data.tile_width = int(root.get('tilewidth'))
+    data.tile_height = int(root.get('tileheight'))
+    data.tilesets = [mapload.parse_tileset(tag) for tag in root.findall('tileset')]
+
+    data.layers = timer.time('layer_decode', lambda: [mapload.parse_layer(tag)
+        for tag in root.findall('layer')])
+    for layer in data.layers:
+        if layer.name == 'collision':
+            data.collision_map = timer.time('collision', CollisionMap.from_data,
+                    layer.data, layer.width, layer.height, data.tile_width,
+                    data.tile_height)
+    data.object_groups = timer.time('objects', lambda: [mapload.parse_object_group(tag,
+        data.tile_width, data.tile_height) for tag in root.findall('objectgroup')])
+
+    if args.gl:
+        # Sliced tilesets are shared between maps, so start from scratch
+        mapload.tilesets.clear()
+        timer.time('tileset_slicing', mapload.load_tilesets, data)
+
+    timer.time('cells', lambda: [build_cells(layer) for layer in data.layers])
+    timer.time('actor_factories', build_actors, data, rows)
+
+    mapload.map_cache.clear()
+    mapload.tilesets.clear()
+    timer.time('load_map', mapload.load_map, mapname)
+
+def compare(results, baseline, threshold):
+    '''Prints how every stage did against the baseline results. Returns the
+    names of the stages that got slower by more than threshold.
+    '''
+    regressions = []
+    # The number of runs doesn't change what is being timed
+    params = dict(results['params'], repeat=None)
+    if params != dict(baseline['params'], repeat=None):
+        print >>sys.stderr, 'warning: baseline was run with %s' % baseline['params']
+    print >>sys.stderr, '%-16s %12s %12s %8s' % ('stage', 'before (ms)', 'after (ms)', 'change')
+    for stage in STAGES:
+        old = baseline['stages'].get(stage)
+        new = results['stages'].get(stage)
+        if old == None or new == None:
+            continue
+        before, after = old['median'], new['median']
+        change = (after - before) / before if before > 0 else 0.0
+        # Ignore changes of less than a tenth of a millisecond, they're noise
+        slower = change > threshold and after - before > 0.0001
+        if slower:
+            regressions.append(stage)
+        print >>sys.stderr, '%-16s %12.3f %12.3f %+7.0f%%%s' % (stage, before * 1000,
+                after * 1000, change * 100, '  REGRESSION' if slower else '')
+    return regressions
+
+def main():
+    if args.gl:
+        window = pyglet.window.Window(visible=False)
+
+    directory = tempfile.mkdtemp()
+    try:
+        save = synthetic.make_data(directory, args.maps, args.size, args.actors,
+                args.properties)
+        pyglet.resource.path.append(directory)
+        pyglet.resource.reindex()
+        game.load_db(save)
+
+        timer = Timer()
+        for i in range(args.repeat):
+            for mapnum in range(1, args.maps + 1):
+                run_stages(timer, 'Bench %d' % mapnum)
+        game.db.close()
+    finally:
+        shutil.rmtree(directory)
+
+    results = {
+        'benchmark': 'maploading',
+        'params': {'maps': args.maps, 'size': args.size, 'actors': args.actors,
+            'properties': args.properties, 'repeat': args.repeat, 'gl': args.gl},
+        'environment': {'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': mapload.tiledata.numpy != None},
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'stages': timer.results(),
+    }
+
+    print >>sys.stderr, '%-16s %12s %12s %12s' % ('stage', 'median (ms)', 'min (ms)', 'max (ms)')
+    for stage in STAGES:
+        result = results['stages'][stage]
+        if result == None:
+            print >>sys.stderr, '%-16s %12s' % (stage, 'skipped')
+        else:
+            print >>sys.stderr, '%-16s %12.3f %12.3f %12.3f' % (stage,
+                    result['median'] * 1000, result['min'] * 1000, result['max'] * 1000)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output != None:
+        f = open(args.output, 'w')
+        f.write(output + '\n')
+        f.close()
+    else:
+        print output
+
+    if args.compare != None:
+        f = open(args.compare)
+        baseline = json.load(f)
+        f.close()
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+'''Map loading with and without the loader pool. Writes a set of synthetic
+tmx maps with large zlib compressed layers and a save file with actors on
+every map, then times mapload.load_map headless from a cold map cache with
+different numbers of worker threads.
+
+Usage: python -m bench.pipeline [map_size] [actors_per_map] [repeat]
+'''
+import os
+import sys
+import time
+import shutil
+import tempfile
+import multiprocessing
+
+from game import headless
+headless.init()
+
+import pyglet
+from game.game import game
+from game import mapload
+from game.actor import actor
+from bench import synthetic
+
+MAPS = 4
+WORKERS = (0, 2, 4)
+
+def time_maps(repeat):
+    # Best of a few rounds, each loading every map from a cold cache
+    best = None
+    for i in range(repeat):
+        mapload.map_cache.clear()
+        start = time.time()
+        for mapnum in range(1, MAPS + 1):
+            mapload.load_map('Bench %d' % mapnum)
+        elapsed = time.time() - start
+        if best == None or elapsed < best:
+            best = elapsed
+    return best
+
+def main(size=256, actors=2000, repeat=3):
+    directory = tempfile.mkdtemp()
+    try:
+        save = synthetic.make_data(directory, MAPS, size, actors)
+        pyglet.resource.path.append(directory)
+        pyglet.resource.reindex()
+        game.load_db(save)
+
+        print '%d maps of %dx%d tiles, %d actors each, %d cores' % (MAPS, size,
+                size, actors, multiprocessing.cpu_count())
+        print '%-10s %10s %10s' % ('workers', 'time (s)', 'speed-up')
+        baseline = None
+        for workers in WORKERS:
+            mapload.start_loader_pool(workers)
+            t = time_maps(repeat)
+            if baseline == None:
+                baseline = t
+            print '%-10d %10.4f %9.2fx' % (workers, t, baseline / t)
+        mapload.start_loader_pool(0)
+        game.db.close()
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
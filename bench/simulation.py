@@ -0,0 +1,91 @@
+'''Headless simulation throughput. Loads a map without a window, fills it
+with wandering NPCs and reports how many simulation ticks per second
+MapScene.update manages for each actor count, both with components kept on
+the actors only and with them also kept in column arrays.
+
+Usage: python -m bench.simulation [map_name] [ticks]
+'''
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+from game import headless
+headless.init()
+
+from game.game import game
+from game import mapload
+from game.config import GameConfig
+from game.actor import actor
+from game.actor.component import SpriteComponent, PhysicsComponent, DumbAI
+from game.util import resource
+
+ACTOR_COUNTS = (10, 50, 100, 500, 1000, 2000)
+TICK = 1.0 / 60
+
+class Wanderer(actor.Actor):
+    '''NPC that walks diagonally and bounces off walls.'''
+    def __init__(self, anims):
+        super(Wanderer, self).__init__()
+        self.size = (24, 24)
+        self.add_component(SpriteComponent(anims))
+        self.add_component(PhysicsComponent(100))
+        self.add_component(DumbAI())
+        self.refresh_components()
+
+def populate(map_scene, count):
+    anims = mapload.load_animset('anims/female.xml')
+    collision_map = map_scene.collision_map
+    for i in range(count):
+        npc = Wanderer(anims)
+        npc.name = 'Wanderer %d' % i
+        # Drop the NPC somewhere it isn't already stuck in a wall
+        while True:
+            x = random.randint(0, collision_map.width * collision_map.tile_width - 24)
+            y = random.randint(0, collision_map.height * collision_map.tile_height - 24)
+            if not collision_map.collides(x, y, 24, 24):
+                break
+        npc.position = (x, y)
+        npc.get_component('physics').direction = (random.choice((-1, 1)),
+                random.choice((-1, 1)))
+        map_scene.actors.add_actor(npc)
+
+def time_ticks(map_name, count, ticks, columns):
+    game.config.set('Simulation', 'columns', str(columns).lower())
+    # Same NPCs in the same places for both storage modes
+    random.seed(count)
+    mapload.map_cache.clear()
+    map_scene = mapload.load_map(map_name)
+    populate(map_scene, count)
+    start = time.time()
+    for i in range(ticks):
+        map_scene.update(TICK)
+    return time.time() - start
+
+def main(map_name='Outside', ticks=300):
+    # Nothing but the storage mode is configured
+    game.config = GameConfig(os.devnull)
+    game.config.add_section('Simulation')
+    # On a copy, loading adds indexes to the save
+    directory = tempfile.mkdtemp()
+    try:
+        game.load_save(os.path.join(directory, 'test.save'),
+                resource.resource_path('saves/test.save'))
+        print '%8s %12s %12s %12s %12s' % ('actors', 'ticks/s', 'ms/tick',
+                'columns t/s', 'columns ms')
+        for count in ACTOR_COUNTS:
+            plain = time_ticks(map_name, count, ticks, False)
+            columns = time_ticks(map_name, count, ticks, True)
+            print '%8d %12.1f %12.3f %12.1f %12.3f' % (count, ticks / plain,
+                    plain * 1000 / ticks, ticks / columns, columns * 1000 / ticks)
+        game.db.close()
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if len(args) > 1:
+        args[1] = int(args[1])
+    main(*args)
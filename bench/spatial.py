@@ -0,0 +1,71 @@
+'''Benchmark for ActorLayer region queries. Compares the old linear scan
+against the spatial hash for a growing number of actors. Every actor does one
+region query with its own bounding box, which is what trigger checking does
+when everybody moves in the same frame.
+
+Usage: python -m bench.spatial [max_actors]
+'''
+import sys
+import time
+import random
+
+from game import headless
+headless.init()
+
+import cocos.rect
+
+from game.map.spatial import SpatialHash
+
+MAP_SIZE = 256 * 32
+ACTOR_SIZE = 24
+# The linear scan is quadratic, stop running it past this many actors
+LINEAR_LIMIT = 2000
+ACTOR_COUNTS = (10, 50, 100, 500, 1000, 2000, 5000, 10000)
+
+class FakeActor(object):
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+        self.width = ACTOR_SIZE
+        self.height = ACTOR_SIZE
+
+def make_actors(count):
+    return [FakeActor(random.randint(0, MAP_SIZE), random.randint(0, MAP_SIZE))
+            for i in range(count)]
+
+def linear_queries(actors):
+    for actor in actors:
+        rect = cocos.rect.Rect(actor.x, actor.y, actor.width, actor.height)
+        found = set()
+        for a in actors:
+            actor_rect = cocos.rect.Rect(a.x, a.y, a.width, a.height)
+            if actor_rect.intersects(rect):
+                found.add(a)
+
+def hash_queries(actors):
+    spatial_hash = SpatialHash()
+    for a in actors:
+        spatial_hash.add(a, a.x, a.y, a.width, a.height)
+    for a in actors:
+        spatial_hash.query(a.x, a.y, a.width, a.height)
+
+def time_it(func, actors):
+    start = time.time()
+    func(actors)
+    return time.time() - start
+
+def main(max_actors=10000):
+    random.seed(0)
+    print '%8s %12s %12s' % ('actors', 'linear (s)', 'hash (s)')
+    for count in ACTOR_COUNTS:
+        if count > max_actors:
+            break
+        actors = make_actors(count)
+        if count <= LINEAR_LIMIT:
+            linear = '%12.4f' % time_it(linear_queries, actors)
+        else:
+            linear = '%12s' % '-'
+        print '%8d %s %12.4f' % (count, linear, time_it(hash_queries, actors))
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
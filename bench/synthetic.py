@@ -0,0 +1,107 @@
+'''Synthetic maps and save files for the map loading benchmarks. Everything
+is generated from a fixed seed so that runs with the same sizes load exactly
+the same data.
+'''
+import os
+import zlib
+import base64
+import random
+import sqlite3
+
+from game.map import tiledata
+
+# Tables of a save file, without the indexes that Game.load_db adds
+SCHEMA = (
+    'CREATE TABLE map (mapnum INTEGER PRIMARY KEY AUTOINCREMENT, name VARCHAR(64), file VARCHAR(256))',
+    '''CREATE TABLE "actor_property" (
+        "propertynum" INTEGER PRIMARY KEY AUTOINCREMENT,
+        "actornum" INTEGER,
+        "property" TEXT,
+        "value" TEXT
+    )''',
+    '''CREATE TABLE actor (
+        "actornum" INTEGER,
+        "mapnum" INTEGER,
+        "type" VARCHAR(128),
+        "name" VARCHAR(128),
+        "group_name" VARCHAR(128),
+        "x" INTEGER,
+        "y" INTEGER,
+        "width" INTEGER,
+        "height" INTEGER
+    )''',
+)
+
+LAYERS = ('ground', 'fringe', 'over', 'collision')
+
+def write_map(path, size, objects=20, seed=0, walls=None):
+    '''Writes a size by size tile tmx map with the usual four zlib
+    compressed layers and an actors object layer with the given number of
+    signs. walls is the fraction of solid collision tiles, by default the
+    collision layer is as random as the others.
+    '''
+    rand = random.Random(seed + size)
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>',
+            '<map version="1.0" orientation="orthogonal" width="%d" height="%d" '
+            'tilewidth="32" tileheight="32">' % (size, size),
+            ' <tileset firstgid="1" name="Exterior_Castle" tilewidth="32" tileheight="32">',
+            '  <image source="tilesets/Exterior_Castle.png" width="800" height="576"/>',
+            ' </tileset>']
+    for name in LAYERS:
+        if name == 'collision' and walls != None:
+            gids = tiledata.from_list([int(rand.random() < walls)
+                for i in range(size * size)])
+        else:
+            gids = tiledata.from_list([rand.choice((0, 0, 1, 2, 17, 50))
+                for i in range(size * size)])
+        data = base64.b64encode(zlib.compress(tiledata.to_string(gids)))
+        lines.append(' <layer name="%s" width="%d" height="%d">' % (name, size, size))
+        lines.append('  <data encoding="base64" compression="zlib">%s</data>' % data)
+        lines.append(' </layer>')
+    lines.append(' <objectgroup name="actors" width="%d" height="%d">' % (size, size))
+    for i in range(objects):
+        lines.append('  <object name="Object %d" type="sign" x="%d" y="%d" width="32" '
+                'height="32"><properties><property name="text" value="Hi"/>'
+                '</properties></object>' % (i, i * 32 % (size * 32), i * 32 % (size * 32)))
+    lines.append(' </objectgroup>')
+    lines.append('</map>')
+    f = open(path, 'w')
+    f.write('\n'.join(lines))
+    f.close()
+
+def make_save(filename, maps, actors, properties=1):
+    '''Writes a save file with maps named "Bench 1" to "Bench <maps>" in
+    maps/bench_<n>.tmx, each with the given number of sign actors.
+    '''
+    db = sqlite3.connect(filename)
+    for sql in SCHEMA:
+        db.execute(sql)
+    rows = []
+    props = []
+    for mapnum in range(1, maps + 1):
+        db.execute('INSERT INTO map (name, file) VALUES (?, ?)',
+                ('Bench %d' % mapnum, 'maps/bench_%d.tmx' % mapnum))
+        for i in range(actors):
+            actornum = mapnum * actors + i
+            rows.append((actornum, mapnum, 'sign', 'Sign %d' % actornum, 'Test',
+                i % 100 * 32, i // 100 * 32, 32, 32))
+            props.append((actornum, 'text', 'Sign number %d' % actornum))
+            for p in range(1, properties):
+                props.append((actornum, 'property%d' % p, 'value %d' % p))
+    db.executemany('INSERT INTO actor VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    db.executemany('INSERT INTO actor_property (actornum, property, value) VALUES (?, ?, ?)', props)
+    db.commit()
+    db.close()
+
+def make_data(directory, maps, size, actors, properties=1, objects=20):
+    '''Fills directory with maps/bench_<n>.tmx files and bench.save.
+    Returns the path of the save file. Add directory to the pyglet resource
+    path to load the maps.
+    '''
+    os.mkdir(os.path.join(directory, 'maps'))
+    for mapnum in range(1, maps + 1):
+        write_map(os.path.join(directory, 'maps', 'bench_%d.tmx' % mapnum),
+                size, objects, mapnum)
+    save = os.path.join(directory, 'bench.save')
+    make_save(save, maps, actors, properties)
+    return save
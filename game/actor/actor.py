@@ -2,7 +2,9 @@ import weakref
 import pyglet
 import cocos
 
-class Actor(pyglet.event.EventDispatcher):
+import events
+
+class Actor(events.Dispatcher):
     '''Actors represent any object on the map that isn't a tile. This class
     is simply a container of components. Mix and match components to create the
     Actors that you need.
@@ -10,7 +12,11 @@ class Actor(pyglet.event.EventDispatcher):
     def __init__(self):
         super(Actor, self).__init__()
         self.name = "Anonymous"
-        self.group = None
+        self._group = None
+        # Row of this actor in the save file, None if it isn't saved
+        self.actornum = None
+        # Persistent properties, saved to the actor_property table
+        self.properties = {}
         self._parent_map = None
         self._x = 0
         self._y = 0
@@ -27,8 +33,7 @@ class Actor(pyglet.event.EventDispatcher):
     def x(self, newx):
         dx = newx - self._x
         self._x = newx
-        self.dispatch_event('on_move', self._x, self._y, dx, 0)
-        self.check_triggers()
+        self.emit(ON_MOVE, self._x, self._y, dx, 0)
 
     @property
     def y(self):
@@ -38,8 +43,7 @@ class Actor(pyglet.event.EventDispatcher):
     def y(self, newy):
         dy = newy - self._y
         self._y = newy
-        self.dispatch_event('on_move', self._x, self._y, 0, dy)
-        self.check_triggers()
+        self.emit(ON_MOVE, self._x, self._y, 0, dy)
 
     @property
     def position(self):
@@ -50,9 +54,24 @@ class Actor(pyglet.event.EventDispatcher):
         newx, newy = position
         dx, dy = newx - self._x, newy - self._y
         self._x, self._y = newx, newy
-        self.dispatch_event('on_move', self._x, self._y, dx, dy)
-        self.check_triggers()
+        self.emit(ON_MOVE, self._x, self._y, dx, dy)
         
+    @property
+    def group(self):
+        return self._group
+
+    @group.setter
+    def group(self, group):
+        self._group = group
+        self.dispatch_event('on_group_change', group)
+
+    def set_property(self, name, value):
+        '''Changes a persistent property. Use this rather than writing to
+        properties directly so that the change gets saved.
+        '''
+        self.properties[name] = value
+        self.dispatch_event('on_property_change', name, value)
+
     @property
     def size(self):
         return (self.width, self.height)
@@ -60,6 +79,12 @@ class Actor(pyglet.event.EventDispatcher):
     @size.setter
     def size(self, size):
         self.width, self.height = size
+        for component in self.components.itervalues():
+            if component._store != None:
+                component._store.set(component._row, 'width', self.width)
+                component._store.set(component._row, 'height', self.height)
+        if self.parent_map != None:
+            self.parent_map.actors.resize_actor(self)
     
     def get_rect(self):
         return cocos.rect.Rect(self._x, self._y, self.width, self.height)
@@ -84,43 +109,21 @@ class Actor(pyglet.event.EventDispatcher):
         self._parent_map = weakref.ref(new_parent_map)
 
     def update(self, dt):
+        '''Updates every component. Actors on a map are updated by its
+        ActorLayer's scheduler instead, one system at a time.
+        '''
         for component in self.components.values():
             component.update(dt)
     
     def check_triggers(self):
-        '''Called when the actor moves. If the calling actor is intersecting
-        any other actors then trigger events will be dispatched.
+        '''Queues the actor for trigger resolution. Moving an actor does this
+        automatically. Trigger events are dispatched in bulk by the parent
+        map's ActorLayer once per frame, see ActorLayer.resolve_triggers.
         '''
         if self.parent_map == None:
             return
 
-        # Get all actors intersecting with bounding box
-        actors = self.parent_map.actors.get_in_region(self.get_rect())
-        # Remove this actor from that list
-        actors.remove(self)
-
-        # Dispatch on_actor_enter on newly intersecting actors
-        enter_actors = actors.difference(self.intersect_actors)
-        for actor in enter_actors:
-            self.dispatch_event('on_actor_enter', actor)
-            actor.intersect_actors.add(self)
-            actor.dispatch_event('on_actor_enter', self)
-
-        # Dispatch on_actor_exit on actors that are no longer intersecting.
-        exit_actors = self.intersect_actors.difference(actors)
-        for actor in exit_actors:
-            self.dispatch_event('on_actor_exit', actor)
-            try:
-                actor.intersect_actors.remove(self)
-            except Exception:
-                pass
-            actor.dispatch_event('on_actor_exit', self)
-
-        for actor in enter_actors.union(exit_actors):
-            actor.check_triggers()
-        
-        # Set new set 
-        self.intersect_actors = actors
+        self.parent_map.actors.dirty.add(self)
 
     def add_component(self, component):
         '''Adds a component to the component dictionary. If a component of the same type is
@@ -167,6 +170,13 @@ class Actor(pyglet.event.EventDispatcher):
         '''
         for component in self.components.values():
             component.on_refresh()
+        # Handlers are wired up now, so work out who gets which event
+        self.build_dispatch_tables()
+        for component in self.components.values():
+            component.build_dispatch_tables()
+        # Let the map catch up with components added while on it
+        if self.parent_map != None:
+            self.parent_map.actors.refresh_actor(self)
 
     def on_enter(self):
         '''Callback function when actor is added to a map.
@@ -187,6 +197,9 @@ class Actor(pyglet.event.EventDispatcher):
 Actor.register_event_type('on_move')
 Actor.register_event_type('on_actor_enter')
 Actor.register_event_type('on_actor_exit')
+Actor.register_event_type('on_group_change')
+Actor.register_event_type('on_property_change')
+ON_MOVE = events.event_id('on_move')
 
 from component import *
 from .. import mapload
@@ -0,0 +1,83 @@
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Every store keeps the owner's bounding box next to the component's own
+# fields since systems nearly always need it
+OWNER_FIELDS = ('x', 'y', 'width', 'height')
+
+class ColumnStore(object):
+    '''Keeps the fields of every component of one type on a map in columns,
+    one array per field with a row per component, so that systems can work
+    on all of them at once instead of visiting every actor. Components stay
+    the way to change the fields, they write through to their row, see
+    Component.set_column. The columns are NumPy float arrays if NumPy is
+    installed and lists otherwise.
+
+    Rows are kept packed: removing a row moves the last one into its place.
+    '''
+    def __init__(self, fields, capacity=64):
+        self.fields = OWNER_FIELDS + tuple(fields)
+        self.size = 0
+        # Component in each row
+        self.owners = []
+        if numpy != None:
+            self.data = dict((field, numpy.zeros(capacity)) for field in self.fields)
+        else:
+            self.data = dict((field, []) for field in self.fields)
+
+    def __len__(self):
+        return self.size
+
+    def column(self, field):
+        '''Returns the live rows of a column. With NumPy this is a view, so
+        copy it before changing components if you need the old values.
+        '''
+        return self.data[field][:self.size]
+
+    def add(self, component):
+        '''Adds a row for the component and its owner and returns its index.'''
+        actor = component.owner
+        values = [actor.x, actor.y, actor.width, actor.height]
+        values.extend(getattr(component, field) for field in component.columns)
+        row = self.size
+        if numpy != None:
+            if row == len(self.data[self.fields[0]]):
+                self._grow()
+            for field, value in zip(self.fields, values):
+                self.data[field][row] = value
+        else:
+            for field, value in zip(self.fields, values):
+                self.data[field].append(value)
+        self.owners.append(component)
+        self.size += 1
+        return row
+
+    def remove(self, row):
+        '''Removes a row. The component in the last row is moved into it.'''
+        last = self.size - 1
+        if row != last:
+            for column in self.data.itervalues():
+                column[row] = column[last]
+            moved = self.owners[last]
+            self.owners[row] = moved
+            moved._row = row
+        self.owners.pop()
+        if numpy == None:
+            for column in self.data.itervalues():
+                column.pop()
+        self.size -= 1
+
+    def set(self, row, field, value):
+        self.data[field][row] = value
+
+    def set_position(self, row, x, y):
+        self.data['x'][row] = x
+        self.data['y'][row] = y
+
+    def _grow(self):
+        for field, column in self.data.items():
+            grown = numpy.zeros(len(column) * 2)
+            grown[:len(column)] = column
+            self.data[field] = grown
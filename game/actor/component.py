@@ -1,7 +1,9 @@
 import pyglet
 import weakref
 
-class Component(pyglet.event.EventDispatcher):
+import events
+
+class Component(events.Dispatcher):
     '''Components provide functionality to Actors. Components avoid the deep
     hierarchy inheritance problem with game objects that share functionality.
     Components should do one thing only and do it well. Components talk to each
@@ -11,6 +13,11 @@ class Component(pyglet.event.EventDispatcher):
     # Class level variable containing a string with the Component's type
     # string. Child classes must set this variable.
     component_type = None
+    # Fields kept in a ColumnStore when the owner is on an ActorLayer that
+    # stores components in columns, see columns.py
+    columns = ()
+    _store = None
+    _row = None
 
     def __init__(self):
         self._owner = None
@@ -34,6 +41,14 @@ class Component(pyglet.event.EventDispatcher):
 
         self._owner = weakref.ref(new_owner)
 
+    @property
+    def event_queue(self):
+        '''Components post their events to their owner's queue.'''
+        owner = self.owner
+        if owner == None:
+            return None
+        return owner.event_queue
+
     def attach(self, actor):
         '''Sets the owner of this component to the given actor. An exception
         will be raised if this component is already owned by someone else.
@@ -50,8 +65,18 @@ class Component(pyglet.event.EventDispatcher):
         this. Use Actor.remove_component instead.
         '''
         self.owner = None
+        if self._store != None:
+            self._store.remove(self._row)
+            self._store = self._row = None
         self.on_detach()
 
+    def set_column(self, field, value):
+        '''Writes a field through to the component's row in its ColumnStore.
+        Components with columns must call this whenever one of them changes.
+        '''
+        if self._store != None:
+            self._store.set(self._row, field, value)
+
     def update(self, dt):
         '''Override this method to do time-based updates.
         '''
@@ -79,21 +104,52 @@ class SpriteComponent(Component):
 
     def __init__(self, anims, offset=(0,0)):
         super(SpriteComponent, self).__init__()
-        self.sprite = cocos.sprite.Sprite(anims['stand_south'], anchor=(0,0))
+        # There is nothing to draw with in headless mode
+        self.sprite = None
+        if not game.headless:
+            self.sprite = cocos.sprite.Sprite(anims['stand_south'], anchor=(0,0))
         # Offset the sprite from the actor's hitbox
         self._dx, self._dy = offset
         self.anims = anims
         self.walking = False
         self.direction = 'south'
+        # Owner position before the last simulation tick and the position
+        # the sprite is currently drawn at
+        self.prev_position = None
+        self.render_position = (0, 0)
+        # Whether direction changes switch animations, see map.lod
+        self.animate = True
 
     def on_refresh(self):
         self.owner.push_handlers(self)
         self.owner.get_component('physics').push_handlers(self)
 
     def on_move(self, x, y, rel_x, rel_y):
-        self.sprite.position = (int(x + self._dx), int(y + self._dy))
+        self.render_position = (x, y)
+        if self.sprite != None:
+            self.sprite.position = (int(x + self._dx), int(y + self._dy))
+
+    def begin_tick(self):
+        self.prev_position = self.owner.position
+
+    def snap(self):
+        '''Forgets the previous tick so the sprite jumps straight to the
+        owner instead of sliding there. Use this after teleporting.
+        '''
+        self.prev_position = None
+
+    def interpolate(self, alpha):
+        if self.prev_position == None:
+            self.prev_position = self.owner.position
+        (x0, y0), (x1, y1) = self.prev_position, self.owner.position
+        x, y = x0 + (x1 - x0) * alpha, y0 + (y1 - y0) * alpha
+        self.render_position = (x, y)
+        if self.sprite != None:
+            self.sprite.position = (int(x + self._dx), int(y + self._dy))
 
     def update_animation(self):
+        if self.sprite == None:
+            return
         prefix = 'walk_' if self.walking else 'stand_'
         self.sprite.image = self.anims[prefix + self.direction]
 
@@ -111,9 +167,9 @@ class SpriteComponent(Component):
             self.direction = 'east'
         elif dx < 0:
             self.direction = 'west'
-        self.update_animation()
+        if self.animate:
+            self.update_animation()
 
-import math
 from ..game import game
 MOVE_NONE = 0
 MOVE_NORTH = 1
@@ -165,8 +221,9 @@ class HumanInputComponent(Component):
         return (self.move & dir) / dir
 
     def _update_physics(self):
-        self.physics.dy = float(self.is_moving(MOVE_NORTH) - self.is_moving(MOVE_SOUTH))
-        self.physics.dx = float(self.is_moving(MOVE_EAST) - self.is_moving(MOVE_WEST))
+        self.physics.direction = (
+                float(self.is_moving(MOVE_EAST) - self.is_moving(MOVE_WEST)),
+                float(self.is_moving(MOVE_NORTH) - self.is_moving(MOVE_SOUTH)))
 
 class DumbAI(Component):
     component_type = 'input'
@@ -184,13 +241,21 @@ class DumbAI(Component):
 
 import pyglet
 class PhysicsComponent(Component):
+    '''Moves the owner in its current direction at the given speed and stops
+    it at solid tiles. The movement itself is done in bulk for every actor on
+    the map by the map's PhysicsSystem.
+    '''
     component_type = 'physics'
+    columns = ('dx', 'dy', 'speed', 'collidable', 'lod')
 
     def __init__(self, speed):
         super(PhysicsComponent, self).__init__()
         self._dx, self._dy = 0, 0
-        self.speed = speed
-        self.collidable = True
+        self._speed = speed
+        self._collidable = True
+        # Level of detail the owner is simulated at, see map.lod. Only FULL
+        # is moved by the PhysicsSystem.
+        self._lod = 0
 
     @property
     def dx(self):
@@ -199,7 +264,8 @@ class PhysicsComponent(Component):
     @dx.setter
     def dx(self, newdx):
         self._dx = newdx
-        self.dispatch_event('on_direction_changed', self._dx, self._dy)
+        self.set_column('dx', newdx)
+        self.post(ON_DIRECTION_CHANGED, self._dx, self._dy)
 
     @property
     def dy(self):
@@ -208,7 +274,8 @@ class PhysicsComponent(Component):
     @dy.setter
     def dy(self, newdy):
         self._dy = newdy
-        self.dispatch_event('on_direction_changed', self._dx, self._dy)
+        self.set_column('dy', newdy)
+        self.post(ON_DIRECTION_CHANGED, self._dx, self._dy)
 
     @property
     def direction(self):
@@ -217,43 +284,39 @@ class PhysicsComponent(Component):
     @direction.setter
     def direction(self, dir):
         self._dx, self._dy = dir
-        self.dispatch_event('on_direction_changed', self._dx, self._dy)
+        self.set_column('dx', self._dx)
+        self.set_column('dy', self._dy)
+        self.post(ON_DIRECTION_CHANGED, self._dx, self._dy)
 
-    def start(self):
-        self.stopped = False
-
-    def update(self, dt):
-        # Normalize direction vector
-        mag = math.sqrt((self._dx * self._dx) + (self._dy * self._dy))
-        if mag != 0:
-            ndx, ndy = self._dx / mag, self._dy / mag
-        else:
-            ndx, ndy = 0, 0
+    @property
+    def speed(self):
+        return self._speed
 
-        # Calculate movement
-        move_x = self._dx * self.speed * dt
-        move_y = self._dy * self.speed * dt
+    @speed.setter
+    def speed(self, speed):
+        self._speed = speed
+        self.set_column('speed', speed)
 
-        # Check collision on X axis
-        rect = self.owner.get_rect()
-        rect.x += move_x
-        collide_x = self.check_collision(rect)
+    @property
+    def collidable(self):
+        return self._collidable
 
-        # Check collision on Y axis
-        rect = self.owner.get_rect()
-        rect.y += move_y
-        collide_y = self.check_collision(rect)
+    @collidable.setter
+    def collidable(self, collidable):
+        self._collidable = collidable
+        self.set_column('collidable', collidable)
 
-        # Move actor
-        if not collide_x:
-            self.owner.x += move_x
+    @property
+    def lod(self):
+        return self._lod
 
-        if not collide_y:
-            self.owner.y += move_y
+    @lod.setter
+    def lod(self, lod):
+        self._lod = lod
+        self.set_column('lod', lod)
 
-        # Dispatch collision event if collision occurred
-        if collide_x or collide_y:
-            self.dispatch_event('on_collision', collide_x, collide_y)
+    def start(self):
+        self.stopped = False
 
     def check_collision(self, rect):
         # Ignore collision test if collidable flag is not set
@@ -261,32 +324,32 @@ class PhysicsComponent(Component):
             return False
 
         if self.owner.parent_map == None:
-            return false
+            return False
 
         # Check map collision
-        for cell in self.owner.parent_map.collision.get_in_region(*(rect.bottomleft + rect.topright)):
-            if cell.tile != None:
-                return True
-
-        return False
+        return self.owner.parent_map.collision_map.collides(rect.x, rect.y,
+                rect.width, rect.height)
 
 # Events for PhysicsComponent
 PhysicsComponent.register_event_type('on_collision')
 PhysicsComponent.register_event_type('on_direction_changed')
+ON_DIRECTION_CHANGED = events.event_id('on_direction_changed')
 
 class PlayerSoundComponent(Component):
     component_type = 'sound'
 
     def __init__(self):
         super(PlayerSoundComponent, self).__init__()
-        self.collision = pyglet.resource.media('sounds/snare.wav', streaming=False)
+        self.collision = None
+        if not game.headless:
+            self.collision = pyglet.resource.media('sounds/snare.wav', streaming=False)
         self.play_collision = True
 
     def on_refresh(self):
         self.owner.get_component('physics').push_handlers(self)
 
     def on_collision(self, collide_x, collide_y):
-        if self.play_collision:
+        if self.play_collision and self.collision != None:
             self.collision.play()
             self.play_collision = False
             def activate_sound(dt):
@@ -0,0 +1,149 @@
+'''Cheaper event dispatch for actors and components. Every event name gets
+an integer id, and each Dispatcher caches, per event id, the handlers to call
+so dispatching doesn't search pyglet's handler stack every time:
+
+    ON_MOVE = events.event_id('on_move')
+    actor.emit(ON_MOVE, x, y, rel_x, rel_y)
+
+Handlers are attached the pyglet way, with push_handlers and friends, or by
+id with bind. The cache is thrown away whenever handlers change and built
+again on the next dispatch, Actor.refresh_components builds it up front.
+
+Events can also be posted instead of dispatched. Posted events wait in the
+dispatcher's event_queue until the next flush, and posting the same event on
+the same dispatcher again before that replaces the earlier one, or is merged
+with it if the event was registered with a merge function, so several changes
+in one tick are handled once. Each ActorLayer has its own queue for its
+actors and their components, and dispatchers without a queue dispatch posted
+events right away.
+'''
+import collections
+import pyglet
+
+# Event name -> id, and names and merge functions by id
+ids = {}
+names = []
+merges = []
+
+def register(name, merge=None):
+    '''Gives an event name an id, if it doesn't have one already, and
+    returns it. merge(old_args, new_args) returns the arguments of one event
+    standing in for two posted ones. Without it the newer event wins.
+    '''
+    if name not in ids:
+        ids[name] = len(names)
+        names.append(name)
+        merges.append(merge)
+    elif merge != None:
+        merges[ids[name]] = merge
+    return ids[name]
+
+def event_id(name):
+    return ids[name]
+
+class EventQueue(object):
+    '''Posted events waiting to be dispatched.'''
+    def __init__(self):
+        # (dispatcher, event id) -> arguments
+        self.pending = collections.OrderedDict()
+
+    def post(self, dispatcher, event_id, args):
+        key = (dispatcher, event_id)
+        old = self.pending.get(key)
+        if old != None and merges[event_id] != None:
+            args = merges[event_id](old, args)
+        self.pending[key] = args
+
+    def discard(self, dispatcher):
+        '''Forgets the events posted on the dispatcher.'''
+        for key in [key for key in self.pending if key[0] is dispatcher]:
+            del self.pending[key]
+
+    def flush(self):
+        '''Dispatches every posted event in the order they were first
+        posted. Events posted by the handlers wait for the next flush.
+        '''
+        if not self.pending:
+            return
+        pending = self.pending
+        self.pending = collections.OrderedDict()
+        for (dispatcher, event_id), args in pending.iteritems():
+            dispatcher.emit(event_id, *args)
+
+class Dispatcher(pyglet.event.EventDispatcher):
+    '''pyglet EventDispatcher with cached dispatch tables. Handlers are
+    called in the same order as pyglet would, from the top of the handler
+    stack down to the dispatcher's own method, stopping at the first that
+    returns True.
+    '''
+    # Event id -> (handlers from the stack, own handler function or None)
+    _tables = None
+    # EventQueue posted events wait in, None to dispatch them right away
+    event_queue = None
+
+    @classmethod
+    def register_event_type(cls, name):
+        register(name)
+        return super(Dispatcher, cls).register_event_type(name)
+
+    def build_dispatch_tables(self):
+        tables = {}
+        for name in getattr(self, 'event_types', ()):
+            handlers = tuple(frame[name] for frame in self._event_stack
+                    if frame.get(name))
+            # The plain function of a method, so the table doesn't hold on
+            # to self
+            own = getattr(getattr(type(self), name, None), 'im_func', None)
+            if own == None and hasattr(self, name):
+                handlers += (getattr(self, name),)
+            tables[ids[name]] = (handlers, own)
+        self._tables = tables
+        return tables
+
+    def emit(self, event_id, *args):
+        '''Dispatches the event with the given id right away.'''
+        tables = self._tables
+        if tables == None:
+            tables = self.build_dispatch_tables()
+        handlers, own = tables[event_id]
+        for handler in handlers:
+            if handler(*args):
+                return True
+        if own != None:
+            return own(self, *args)
+        return False
+
+    def post(self, event_id, *args):
+        '''Queues the event for the next flush of the event queue.'''
+        queue = self.event_queue
+        if queue == None:
+            self.emit(event_id, *args)
+        else:
+            queue.post(self, event_id, args)
+
+    def dispatch_event(self, event_type, *args):
+        return self.emit(ids[event_type], *args)
+
+    def bind(self, event_id, handler):
+        self.push_handlers(**{names[event_id]: handler})
+
+    def unbind(self, event_id, handler):
+        self.remove_handlers(**{names[event_id]: handler})
+
+    # Anything that changes the handlers invalidates the tables
+
+    def set_handler(self, name, handler):
+        super(Dispatcher, self).set_handler(name, handler)
+        self._tables = None
+
+    def pop_handlers(self):
+        super(Dispatcher, self).pop_handlers()
+        self._tables = None
+
+    def remove_handlers(self, *args, **kwargs):
+        super(Dispatcher, self).remove_handlers(*args, **kwargs)
+        self._tables = None
+
+    def remove_handler(self, name, handler):
+        super(Dispatcher, self).remove_handler(name, handler)
+        self._tables = None
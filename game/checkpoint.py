@@ -0,0 +1,131 @@
+import sys
+import threading
+import traceback
+import weakref
+import Queue
+
+class Checkpoint(object):
+    '''Writes changed actor state back to the save file. Tracked actors are
+    marked dirty when they move, change group or change a persistent
+    property, and a flush writes only the rows of dirty actors, all in one
+    transaction.
+
+    flush_async takes the snapshot on the calling thread, which is cheap,
+    and leaves the writing to a worker thread with its own connection from
+    connect(filename) so that saving doesn't hitch the frame. Writes that
+    fail, for example because the file is locked, are kept and tried again
+    with the next flush.
+    '''
+    def __init__(self, db, connect=None):
+        self.db = db
+        self.connect = connect
+        # Actor -> set of what changed: 'actor' for the actor row, otherwise
+        # property names
+        self.dirty = {}
+        self.writes = Queue.Queue()
+        self.thread = None
+        # Changes whose write failed, oldest first
+        self.failed = []
+        self.failed_lock = threading.Lock()
+
+    def track(self, actor):
+        '''Starts saving changes to the given actor. Only actors with an
+        actornum can be tracked.
+        '''
+        if actor.actornum == None:
+            raise ValueError("Actor '%s' has no row in the save file" % (actor.name,))
+
+        dirty = self.dirty
+        actor_ref = weakref.ref(actor)
+        def mark(what):
+            actor = actor_ref()
+            if actor != None:
+                dirty.setdefault(actor, set()).add(what)
+        def on_move(x, y, rel_x, rel_y):
+            mark('actor')
+        def on_group_change(group):
+            mark('actor')
+        def on_property_change(name, value):
+            mark(name)
+        actor.push_handlers(on_move=on_move, on_group_change=on_group_change,
+                on_property_change=on_property_change)
+
+    def snapshot(self):
+        '''Returns the pending changes as plain data and forgets about them.
+        Actor rows are (mapnum, x, y, group, actornum) and properties are
+        (actornum, name, value). mapnum is None for actors that aren't on a
+        map, in which case the stored map is kept. Changes from failed writes
+        come first so that newer ones win.
+        '''
+        with self.failed_lock:
+            actors = [row for changes in self.failed for row in changes[0]]
+            properties = [row for changes in self.failed for row in changes[1]]
+            self.failed = []
+        for actor, changes in self.dirty.items():
+            if 'actor' in changes:
+                changes.discard('actor')
+                parent_map = actor.parent_map
+                mapnum = getattr(parent_map, 'mapnum', None)
+                actors.append((mapnum, int(actor.x), int(actor.y), actor.group,
+                    actor.actornum))
+            for name in changes:
+                properties.append((actor.actornum, name, actor.properties[name]))
+        self.dirty.clear()
+        return actors, properties
+
+    def flush(self):
+        '''Writes every pending change now. Waits for earlier asynchronous
+        flushes first so that writes land in order.
+        '''
+        if self.thread != None:
+            self.writes.join()
+        changes = self.snapshot()
+        try:
+            self.write(self.db, changes)
+        except Exception:
+            self._failed(changes)
+
+    def flush_async(self):
+        '''Snapshots the pending changes and writes them on a worker
+        thread.
+        '''
+        if not self.dirty and not self.failed:
+            return
+
+        if self.thread == None:
+            self.thread = threading.Thread(target=self._run, name='Checkpoint')
+            self.thread.daemon = True
+            self.thread.start()
+        self.writes.put(self.snapshot())
+
+    def write(self, db, changes):
+        actors, properties = changes
+        if not actors and not properties:
+            return
+
+        with db.transaction():
+            if actors:
+                db.executemany('save_actor', actors)
+            for actornum, name, value in properties:
+                cursor = db.execute('save_actor_property', (value, actornum, name))
+                if cursor.rowcount == 0:
+                    db.execute('add_actor_property', (actornum, name, value))
+
+    def _failed(self, changes):
+        print >>sys.stderr, 'Checkpoint write failed, will retry:'
+        traceback.print_exc()
+        with self.failed_lock:
+            self.failed.append(changes)
+
+    def _run(self):
+        db = None
+        while True:
+            changes = self.writes.get()
+            try:
+                if db == None:
+                    db = self.connect(self.db.filename)
+                self.write(db, changes)
+            except Exception:
+                self._failed(changes)
+            finally:
+                self.writes.task_done()
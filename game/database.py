@@ -0,0 +1,129 @@
+import time
+import sqlite3
+import contextlib
+
+class Database(object):
+    '''Data-access layer for save files. All SQL the game runs is kept here as
+    named statements. The sqlite module compiles each distinct SQL string
+    once and keeps the prepared statement in a per-connection cache, so
+    sticking to these fixed strings means statements are never recompiled.
+    Every statement's run time is recorded in timings.
+    '''
+    statements = {
+        'map':
+            'SELECT mapnum, file FROM map WHERE name=?',
+        'actors':
+            'SELECT actornum, type, name, group_name, x, y, width, height\
+            FROM actor WHERE mapnum=?',
+        'actor_properties':
+            'SELECT actornum, property, value FROM actor_property\
+            WHERE actornum IN (SELECT actornum FROM actor WHERE mapnum=?)\
+            ORDER BY propertynum',
+        'save_actor':
+            'UPDATE actor SET mapnum=coalesce(?, mapnum), x=?, y=?,\
+            group_name=? WHERE actornum=?',
+        'save_actor_property':
+            'UPDATE actor_property SET value=? WHERE actornum=? AND property=?',
+        'add_actor_property':
+            'INSERT INTO actor_property (actornum, property, value)\
+            VALUES (?, ?, ?)',
+        'create_actor_index':
+            'CREATE INDEX IF NOT EXISTS actor_mapnum ON actor (mapnum)',
+        'create_actor_property_index':
+            'CREATE INDEX IF NOT EXISTS actor_property_actornum\
+            ON actor_property (actornum)',
+    }
+
+    # PRAGMAs that may be set from the [Database] section of the config
+    pragmas = ('journal_mode', 'cache_size', 'mmap_size', 'synchronous')
+
+    def __init__(self, filename, pragmas=None):
+        self.filename = filename
+        # Room for every named statement plus some ad-hoc ones
+        self.connection = sqlite3.connect(filename,
+                cached_statements=len(self.statements) + 32)
+        self.connection.row_factory = sqlite3.Row
+        # Statement name -> [number of runs, total seconds, slowest run]
+        self.timings = {}
+        if pragmas != None:
+            self.set_pragmas(pragmas)
+
+    def set_pragmas(self, pragmas):
+        '''Applies a dictionary of PRAGMA names to values. Names that aren't
+        in Database.pragmas raise a ValueError since PRAGMA statements can't
+        take parameters.
+        '''
+        for name, value in pragmas.items():
+            if name not in self.pragmas:
+                raise ValueError('Unsupported PRAGMA: %s' % name)
+            # Values come from our own config, but keep them to plain words
+            if not str(value).lstrip('-').isalnum():
+                raise ValueError('Bad value for PRAGMA %s: %s' % (name, value))
+            self.connection.execute('PRAGMA %s=%s' % (name, value)).fetchall()
+
+    def execute(self, name, params=()):
+        '''Runs the named statement and returns the cursor. Only the time
+        spent in execute is recorded, use query to include fetching.
+        '''
+        start = time.time()
+        cursor = self.connection.execute(self.statements[name], params)
+        self._record(name, time.time() - start)
+        return cursor
+
+    def query(self, name, params=()):
+        '''Runs the named statement and returns all of its rows.'''
+        start = time.time()
+        rows = self.connection.execute(self.statements[name], params).fetchall()
+        self._record(name, time.time() - start)
+        return rows
+
+    def query_one(self, name, params=()):
+        '''Runs the named statement and returns its first row or None.'''
+        start = time.time()
+        row = self.connection.execute(self.statements[name], params).fetchone()
+        self._record(name, time.time() - start)
+        return row
+
+    def executemany(self, name, seq_of_params):
+        '''Runs the named statement once for each set of parameters.'''
+        start = time.time()
+        cursor = self.connection.executemany(self.statements[name], seq_of_params)
+        self._record(name, time.time() - start)
+        return cursor
+
+    @contextlib.contextmanager
+    def transaction(self):
+        '''Commits everything run inside the with block as one transaction,
+        or rolls it all back if an exception is raised.
+        '''
+        try:
+            yield self
+        except:
+            self.connection.rollback()
+            raise
+        else:
+            self.connection.commit()
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def _record(self, name, elapsed):
+        timing = self.timings.get(name)
+        if timing == None:
+            self.timings[name] = [1, elapsed, elapsed]
+        else:
+            timing[0] += 1
+            timing[1] += elapsed
+            if elapsed > timing[2]:
+                timing[2] = elapsed
+
+    def report(self):
+        '''Returns the statement timings as a printable table.'''
+        lines = ['%-28s %8s %10s %10s' % ('statement', 'runs', 'avg (ms)', 'max (ms)')]
+        for name, (runs, total, slowest) in sorted(self.timings.items()):
+            lines.append('%-28s %8d %10.3f %10.3f' % (name, runs,
+                total * 1000 / runs, slowest * 1000))
+        return '\n'.join(lines)
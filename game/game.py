@@ -1,6 +1,9 @@
+import os
+import shutil
 import config
-import sqlite3
 import pyglet
+from database import Database
+from checkpoint import Checkpoint
 
 class Game(object):
     '''The Game class contains all of the game's global state. Yeah, yeah,
@@ -10,12 +13,20 @@ class Game(object):
     '''
     def __init__(self):
         self.db = None
+        self.db_filename = None
+        # Saves changed actor state, see load_db
+        self.checkpoint = None
         self.config = None
+        # Headless mode loads maps and actors without textures, sprites or
+        # sound. See game.headless.
+        self.headless = False
 
-        # Add resource file paths
-        pyglet.resource.path.append('data')
+        # Add resource file paths. They are absolute so that scripts other
+        # than test.py, such as the benchmarks, find the same data directory.
+        data = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+        pyglet.resource.path.append(data)
         #pyglet.resource.path.append('data/images')
-        pyglet.resource.path.append('data/maps')
+        pyglet.resource.path.append(os.path.join(data, 'maps'))
         #pyglet.resource.path.append('data/anims')
         #pyglet.resource.path.append('data/sounds')
         pyglet.resource.reindex()
@@ -25,8 +36,39 @@ class Game(object):
         self.config = config.GameConfig(filename)
 
     def load_db(self, filename):
-        self.db = sqlite3.connect(filename)
-        self.db.row_factory = sqlite3.Row
+        # Kept so that other threads can open their own connections
+        self.db_filename = filename
+        self.db = self.open_db(filename)
+        self.create_indexes()
+        self.checkpoint = Checkpoint(self.db, self.open_db)
+
+    def load_save(self, filename, template):
+        '''Loads a save file, starting it as a copy of template if it doesn't
+        exist yet. Loading changes the file, it gets indexes, the journal
+        mode from the config and checkpointed actor state, so the template
+        itself is left alone.
+        '''
+        if not os.path.exists(filename):
+            shutil.copyfile(template, filename)
+        self.load_db(filename)
+
+    def open_db(self, filename):
+        '''Opens a new connection to a save file, set up with the PRAGMAs
+        from the [Database] section of the config.
+        '''
+        pragmas = None
+        if self.config != None and self.config.has_section('Database'):
+            pragmas = dict((name, value) for name, value
+                    in self.config.items('Database') if name in Database.pragmas)
+        return Database(filename, pragmas)
+
+    def create_indexes(self):
+        '''Adds the indexes that map loading relies on to save files that
+        were created without them.
+        '''
+        self.db.execute('create_actor_index')
+        self.db.execute('create_actor_property_index')
+        self.db.commit()
 
 # Global game instance
 game = Game()
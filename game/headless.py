@@ -0,0 +1,29 @@
+'''Headless mode runs maps and actors without a window, textures or sound so
+that the simulation can be driven from a plain Python loop on machines with
+no GPU:
+
+    from game import headless
+    headless.init()
+    ...
+    map_scene = mapload.load_map('Outside')
+    while True:
+        map_scene.update(1.0 / 60)
+
+This module must be imported before anything else that imports pyglet.gl or
+cocos, because pyglet creates a hidden OpenGL window on that import unless it
+is told not to.
+'''
+import pyglet
+pyglet.options['shadow_window'] = False
+pyglet.options['audio'] = ('silent',)
+
+from cocos.director import director
+from game import game
+
+def init(width=800, height=600):
+    '''Switches the game to headless mode. width and height are the window
+    size that cocos nodes see since there is no real window to ask.
+    '''
+    game.headless = True
+    director._window_virtual_width = width
+    director._window_virtual_height = height
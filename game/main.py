@@ -3,8 +3,11 @@ from game import game
 from map.mapscene import *
 from actor import actor
 from cocos.director import director
+import os
 import weakref
+import pyglet
 import util.resource
+from profiler import profiler
 
 def main():
     game.load_config('rpg.conf')
@@ -14,9 +17,37 @@ def main():
             fullscreen=game.config.getboolean("Graphics", "fullscreen"))
     director.show_FPS = True
     
-    # Load database
+    # Load database. The test save in the repo is only the starting point
+    # for the save that gets played on.
     print dir(util)
-    game.load_db(util.resource.resource_path('saves/test.save'))
+    template = util.resource.resource_path('saves/test.save')
+    game.load_save(os.path.join(os.path.dirname(template), 'user.save'), template)
+    # Write changed actor state back in the background every so often
+    if game.config.has_option('Database', 'autosave_interval'):
+        def autosave(dt):
+            game.checkpoint.flush_async()
+        pyglet.clock.schedule_interval(autosave,
+                game.config.getfloat('Database', 'autosave_interval'))
+
+    # Profiler overlay, toggled with a key. Stats are written to a file
+    # whenever it is turned off.
+    def on_key_press(symbol, modifiers):
+        if symbol != game.config.get_keycode('profiler'):
+            return
+        if profiler.enabled:
+            profiler.hide_overlay()
+            profiler.disable()
+            if game.config.has_option('Profiler', 'dump'):
+                profiler.dump(game.config.get('Profiler', 'dump'))
+        else:
+            profiler.enable()
+            profiler.show_overlay()
+    if game.config.has_option('Controls', 'profiler'):
+        director.window.push_handlers(on_key_press=on_key_press)
+
+    # Load maps with a few worker threads
+    if game.config.has_option('Loading', 'workers'):
+        mapload.start_loader_pool(game.config.getint('Loading', 'workers'))
 
     # Load map scene
     def death(ref):
@@ -58,3 +89,6 @@ def main():
     #print "Start: %d" % (getrefcount(map),)
     # Run map scene
     director.run(map_scene())
+    # Save what changed since the last autosave or map change. This waits
+    # for autosaves that are still being written.
+    game.checkpoint.flush()
@@ -0,0 +1,123 @@
+import weakref
+
+from scheduler import updates
+import lod
+
+class ActivitySystem(object):
+    '''Keeps track of which actors on a map need simulating. Actors that
+    aren't trying to move and have no components with updates are put to
+    sleep, and so are actors with updates that stand still outside the active
+    region, the view and the area around the player grown by margin pixels.
+    Actors that SimulationLOD only catches up now and then sleep as well.
+    Sleeping actors are left out of the scheduler, physics and sprite
+    interpolation, so a tick costs about the same however many of them there
+    are.
+
+    Actors wake up when they are moved, when their direction changes, when
+    they are refreshed and, if they have updates, when the active region
+    reaches them.
+    '''
+    def __init__(self, scheduler, spatial_hash, margin=256):
+        self.scheduler = scheduler
+        self.spatial_hash = spatial_hash
+        self.margin = margin
+        self.awake = set()
+        self.sleeping = set()
+        # Actors with components that override update
+        self.busy = set()
+        # (x, y, width, height) of the active region, None to keep actors
+        # with updates awake everywhere
+        self.region = None
+        self._direction_handlers = {}
+
+    def add(self, actor):
+        self.awake.add(actor)
+        self.scheduler.add(actor)
+        self._watch(actor)
+
+    def remove(self, actor):
+        self.awake.discard(actor)
+        self.sleeping.discard(actor)
+        self.busy.discard(actor)
+        self.scheduler.remove(actor)
+        self._unwatch(actor)
+
+    def refresh(self, actor):
+        '''Picks up components added to or removed from the actor.'''
+        self.wake(actor)
+        self.scheduler.refresh(actor)
+        self._unwatch(actor)
+        self._watch(actor)
+
+    def wake(self, actor):
+        if actor in self.sleeping:
+            self.sleeping.remove(actor)
+            self.awake.add(actor)
+            self.scheduler.add(actor)
+
+    def sleep(self, actor):
+        self.awake.remove(actor)
+        self.sleeping.add(actor)
+        self.scheduler.remove(actor)
+        # Leave the sprite where the actor stopped rather than part of the
+        # way there
+        graphics = actor.components.get('graphics')
+        if graphics != None:
+            graphics.snap()
+            graphics.interpolate(1.0)
+
+    def set_region(self, region):
+        '''Moves the active region and wakes the actors with updates in it.'''
+        self.region = region
+        if region == None:
+            for actor in list(self.sleeping & self.busy):
+                self.wake(actor)
+            return
+        for actor in self.spatial_hash.query(*self._grown(region)):
+            if actor in self.busy:
+                self.wake(actor)
+
+    def settle(self):
+        '''Puts every awake actor that has nothing to do to sleep.'''
+        region = self.region
+        if region != None:
+            left, bottom, width, height = self._grown(region)
+            right, top = left + width, bottom + height
+        for actor in list(self.awake):
+            physics = actor.components.get('physics')
+            if physics != None and (physics._dx != 0 or physics._dy != 0) and \
+                    physics._lod != lod.FAR:
+                continue
+            if actor in self.busy:
+                if region == None:
+                    continue
+                # Still in the active region
+                if actor.x < right and actor.x + actor.width > left and \
+                        actor.y < top and actor.y + actor.height > bottom:
+                    continue
+            self.sleep(actor)
+
+    def _grown(self, region):
+        x, y, width, height = region
+        margin = self.margin
+        return (x - margin, y - margin, width + 2 * margin, height + 2 * margin)
+
+    def _watch(self, actor):
+        if any(updates(component) for component in actor.components.itervalues()):
+            self.busy.add(actor)
+        else:
+            self.busy.discard(actor)
+        physics = actor.components.get('physics')
+        if physics == None:
+            return
+        # Only a weak reference to the actor, like the layer's move handlers
+        actor_ref = weakref.ref(actor)
+        def on_direction_changed(dx, dy):
+            self.wake(actor_ref())
+        physics.push_handlers(on_direction_changed=on_direction_changed)
+        self._direction_handlers[actor] = (physics, on_direction_changed)
+
+    def _unwatch(self, actor):
+        if actor in self._direction_handlers:
+            physics, handler = self._direction_handlers.pop(actor)
+            physics.remove_handlers(on_direction_changed=handler)
@@ -0,0 +1,247 @@
+import pyglet
+from pyglet.gl import *
+import cocos
+
+import tiledata
+
+class DrawCounter(object):
+    '''Counts the OpenGL draw calls and tiles drawn by tile layers. MapScene
+    calls frame at the start of every frame, after which the last_ values
+    hold the totals of the previous frame.
+    '''
+    def __init__(self):
+        self.draw_calls = self.tiles = 0
+        self.last_draw_calls = self.last_tiles = 0
+
+    def frame(self):
+        self.last_draw_calls, self.last_tiles = self.draw_calls, self.tiles
+        self.draw_calls = self.tiles = 0
+
+draw_counter = DrawCounter()
+
+class Chunk(object):
+    '''A square block of cells of a ChunkedRectMapLayer. columns holds the
+    chunk's cells as [i][j] like RectMap.cells. Tiles never change once a
+    map is loaded, so chunks that are drawn get baked into one vertex list
+    per texture, see bake.
+    '''
+    def __init__(self, columns):
+        self.columns = columns
+        # List of (texture, vertex list, tile count), None until baked
+        self.vertex_lists = None
+
+    def bake(self):
+        # Texture id -> (texture, vertices, texture coordinates)
+        quads = {}
+        for column in self.columns:
+            for cell in column:
+                if cell.tile == None:
+                    continue
+                image = cell.tile.image
+                texture = image.get_texture()
+                x, y = cell.origin[:2]
+                x2, y2 = x + image.width, y + image.height
+                if texture.id not in quads:
+                    quads[texture.id] = (texture, [], [])
+                vertices, tex_coords = quads[texture.id][1:]
+                vertices.extend((x, y, x2, y, x2, y2, x, y2))
+                tex_coords.extend(texture.tex_coords)
+
+        self.vertex_lists = []
+        for texture, vertices, tex_coords in quads.values():
+            count = len(vertices) / 2
+            self.vertex_lists.append((texture, pyglet.graphics.vertex_list(count,
+                ('v2i/static', vertices), ('t3f/static', tex_coords)), count / 4))
+
+    def delete_vertex_lists(self):
+        if self.vertex_lists != None:
+            for texture, vertex_list, tiles in self.vertex_lists:
+                vertex_list.delete()
+        self.vertex_lists = None
+
+class LazyCells(object):
+    '''Stands in for RectMap.cells. Cells are created chunk by chunk as they
+    are looked up.
+    '''
+    def __init__(self, layer):
+        self.layer = layer
+
+    def __len__(self):
+        return self.layer.width
+
+    def __getitem__(self, i):
+        if i < 0 or i >= self.layer.width:
+            raise IndexError(i)
+        return LazyColumn(self.layer, i)
+
+    def __iter__(self):
+        for i in range(self.layer.width):
+            yield LazyColumn(self.layer, i)
+
+class LazyColumn(object):
+    def __init__(self, layer, i):
+        self.layer = layer
+        self.i = i
+
+    def __len__(self):
+        return self.layer.height
+
+    def __getitem__(self, j):
+        if j < 0 or j >= self.layer.height:
+            raise IndexError(j)
+        return self.layer.get_cell(self.i, j)
+
+    def __iter__(self):
+        for j in range(self.layer.height):
+            yield self.layer.get_cell(self.i, j)
+
+class ChunkedRectMapLayer(cocos.tiles.RectMapLayer):
+    '''RectMapLayer that keeps only the layer's gids around and creates
+    cells and vertex lists for chunk_size by chunk_size blocks of tiles when
+    they are needed. Chunks within margin chunks of the view are baked ready
+    for drawing, and chunks more than keep chunks away from the view are
+    thrown away again, so the cost of a layer depends on the size of the
+    screen rather than the size of the map.
+
+    Drawing takes one draw call per texture per chunk in view instead of a
+    sprite per tile.
+
+    grid is the layer's gids as rows, top row first, see LayerData.grid.
+    '''
+    def __init__(self, id, tile_width, tile_height, grid, width, height,
+            tileset, chunk_size=16, margin=1, keep=2):
+        # Layer dimensions in tiles
+        self.width = width
+        self.height = height
+        # Not self.grid, CocosNode uses that for grid effects
+        self.gids = grid
+        self.tileset = tileset
+        self.chunk_size = chunk_size
+        self.margin = margin
+        self.keep = max(keep, margin)
+        # (chunk column, chunk row) -> Chunk
+        self.chunks = {}
+        # Chunk range that is baked
+        self._view_chunks = None
+        # Texture id -> SpriteGroup that sets the texture and blending up
+        self._groups = {}
+        super(ChunkedRectMapLayer, self).__init__(id, tile_width, tile_height,
+                LazyCells(self), (0, 0, 0), None)
+
+    def get_chunk(self, ci, cj):
+        '''Returns chunk (ci, cj), creating its cells if needed.'''
+        chunk = self.chunks.get((ci, cj))
+        if chunk == None:
+            chunk = self.chunks[ci, cj] = self._load_chunk(ci, cj)
+        return chunk
+
+    def _load_chunk(self, ci, cj):
+        size = self.chunk_size
+        left = ci * size
+        bottom = cj * size
+        width = min(size, self.width - left)
+        height = min(size, self.height - bottom)
+        # Grid rows count from the top
+        rows = tiledata.block(self.gids, left, self.height - bottom - height,
+                width, height)
+        rows.reverse()
+
+        tileset = self.tileset
+        tw, th = self.tw, self.th
+        columns = []
+        for di, gids in enumerate(zip(*rows)):
+            i = left + di
+            columns.append([cocos.tiles.RectCell(i, bottom + dj, tw, th, None,
+                tileset[gid - 1] if gid != 0 else None)
+                for dj, gid in enumerate(gids)])
+        return Chunk(columns)
+
+    def get_cell(self, i, j):
+        if i < 0 or j < 0 or i >= self.width or j >= self.height:
+            return None
+        size = self.chunk_size
+        return self.get_chunk(i // size, j // size).columns[i % size][j % size]
+
+    def get_in_region(self, x1, y1, x2, y2):
+        # Same bounds as RectMap.get_in_region
+        x1 = max(0, int((x1 - self.origin_x) // self.tw))
+        y1 = max(0, int((y1 - self.origin_y) // self.th))
+        x2 = min(self.width, int((x2 - self.origin_x) // self.tw + 1))
+        y2 = min(self.height, int((y2 - self.origin_y) // self.th + 1))
+        get_cell = self.get_cell
+        return [get_cell(i, j) for i in range(x1, x2) for j in range(y1, y2)]
+
+    def chunk_range(self, margin):
+        '''Returns the chunks within margin chunks of the view as
+        (left, bottom, right, top), inclusive.
+        '''
+        chunk_width = self.chunk_size * self.tw
+        chunk_height = self.chunk_size * self.th
+        x = self.view_x - self.origin_x
+        y = self.view_y - self.origin_y
+        return (max(0, int(x // chunk_width) - margin),
+                max(0, int(y // chunk_height) - margin),
+                min((self.width - 1) // self.chunk_size,
+                    int((x + self.view_w) // chunk_width) + margin),
+                min((self.height - 1) // self.chunk_size,
+                    int((y + self.view_h) // chunk_height) + margin))
+
+    def _update_sprite_set(self):
+        # Called with every view change, but chunks only change hands when
+        # the view crosses a chunk border
+        view_chunks = self.chunk_range(self.margin)
+        if view_chunks == self._view_chunks:
+            return
+        self._view_chunks = view_chunks
+
+        left, bottom, right, top = self.chunk_range(self.keep)
+        for key in self.chunks.keys():
+            ci, cj = key
+            if ci < left or ci > right or cj < bottom or cj > top:
+                self.chunks.pop(key).delete_vertex_lists()
+
+        left, bottom, right, top = view_chunks
+        for ci in range(left, right + 1):
+            for cj in range(bottom, top + 1):
+                chunk = self.get_chunk(ci, cj)
+                if chunk.vertex_lists == None:
+                    chunk.bake()
+
+    def set_dirty(self):
+        for chunk in self.chunks.values():
+            chunk.delete_vertex_lists()
+        self._view_chunks = None
+        self._update_sprite_set()
+
+    def _get_group(self, texture):
+        group = self._groups.get(texture.id)
+        if group == None:
+            group = self._groups[texture.id] = pyglet.sprite.SpriteGroup(
+                    texture, GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+        return group
+
+    def draw(self):
+        if self._view_chunks == None:
+            return
+
+        # Only the chunks actually in view, grouped by texture so each
+        # texture is bound once
+        left, bottom, right, top = self.chunk_range(0)
+        textures = {}
+        for ci in range(left, right + 1):
+            for cj in range(bottom, top + 1):
+                for texture, vertex_list, tiles in self.chunks[ci, cj].vertex_lists:
+                    textures.setdefault(texture.id, (texture, []))[1].append(
+                            (vertex_list, tiles))
+
+        glPushMatrix()
+        self.transform()
+        for texture, vertex_lists in textures.values():
+            group = self._get_group(texture)
+            group.set_state()
+            for vertex_list, tiles in vertex_lists:
+                vertex_list.draw(GL_QUADS)
+                draw_counter.draw_calls += 1
+                draw_counter.tiles += tiles
+            group.unset_state()
+        glPopMatrix()
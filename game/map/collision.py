@@ -0,0 +1,52 @@
+import tiledata
+
+class CollisionMap(object):
+    '''Solidity bitmap of a map's collision layer. There is one byte per tile,
+    1 for solid and 0 for empty, stored row by row starting from the bottom
+    of the map so that tile (i, j) lines up with RectMapLayer cell (i, j).
+    '''
+    def __init__(self, width, height, tile_width, tile_height, solid=None):
+        # Map dimensions in tiles
+        self.width = width
+        self.height = height
+        # Tile dimensions in pixels
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        if solid == None:
+            solid = bytearray(width * height)
+        self.solid = solid
+
+    @classmethod
+    def from_data(cls, data, width, height, tile_width, tile_height):
+        '''Builds a collision map from tmx layer data. Tmx layers are stored
+        top row first and any non-zero tile is solid.
+        '''
+        return cls(width, height, tile_width, tile_height,
+                tiledata.solid(data, width, height))
+
+    def is_solid(self, i, j):
+        '''Tests if tile (i, j) is solid. Tiles outside of the map are never
+        solid.
+        '''
+        if i < 0 or j < 0 or i >= self.width or j >= self.height:
+            return False
+        return self.solid[j * self.width + i] == 1
+
+    def collides(self, x, y, width, height):
+        '''Tests if the given pixel space box touches any solid tile. Tiles
+        are picked the same way as RectMapLayer.get_in_region so edges that
+        touch a solid tile count as a collision.
+        '''
+        left = max(0, int(x // self.tile_width))
+        bottom = max(0, int(y // self.tile_height))
+        right = min(self.width, int((x + width) // self.tile_width) + 1)
+        top = min(self.height, int((y + height) // self.tile_height) + 1)
+        if left >= right:
+            return False
+
+        solid = self.solid
+        for j in range(bottom, top):
+            start = j * self.width
+            if solid.find('\x01', start + left, start + right) != -1:
+                return True
+        return False
@@ -0,0 +1,221 @@
+import collections
+
+# Levels of detail an actor with physics is simulated at
+FULL = 0
+COARSE = 1
+FAR = 2
+
+class SimulationLOD(object):
+    '''Simulates moving actors in less detail the further they are from the
+    map's focus. Distances are measured along whichever axis is further, so
+    the bands are squares around the focus:
+
+        FULL    within near pixels, PhysicsSystem moves them every tick and
+                triggers are resolved
+        COARSE  within far pixels, they move in steps of about a tile at a
+                time, without triggers or animation
+        FAR     everything else, they sleep and are only caught up on the
+                time they missed every interval seconds or so, or as soon as
+                they come within far pixels
+
+    Only actors with a physics component have a level, and an actor that
+    comes back to FULL gets its triggers resolved and its animation set
+    right away. Moves made for the COARSE and FAR levels still stop at solid
+    tiles and dispatch on_collision.
+
+    Bands are checked with two spatial hash queries around the focus per
+    tick, so COARSE and FULL actors cost something every tick and FAR ones
+    very little.
+    '''
+    def __init__(self, layer, near=None, far=None, interval=0.5, max_steps=200):
+        self.layer = layer
+        self.near = near
+        self.far = far
+        self.interval = interval
+        # Most steps taken to catch up one actor at once
+        self.max_steps = max_steps
+        # Simulation time in seconds
+        self.time = 0.0
+        # Actor -> level, for every actor with physics
+        self.levels = {}
+        # Actors at FULL or COARSE
+        self.active = set()
+        # COARSE actor -> seconds of movement not made yet
+        self.coarse = {}
+        # FAR actor -> simulation time it was last caught up to
+        self.far_actors = {}
+        # FAR actors in the order they get caught up in, each at most once
+        self._far_queue = collections.deque()
+        self._queued = set()
+
+    @property
+    def enabled(self):
+        return self.near != None and self.far != None
+
+    def set_bands(self, near, far):
+        '''Sets the band distances in pixels. None turns LOD off.'''
+        self.near = near
+        self.far = far
+        if not self.enabled:
+            self.reset()
+
+    def add(self, actor):
+        if 'physics' in actor.components:
+            self.levels[actor] = FULL
+            self.active.add(actor)
+
+    def remove(self, actor):
+        if actor in self.levels:
+            del self.levels[actor]
+            self.coarse.pop(actor, None)
+            self.far_actors.pop(actor, None)
+            self.active.discard(actor)
+            # The component may be what was removed
+            physics = actor.components.get('physics')
+            if physics != None:
+                physics.lod = FULL
+            graphics = actor.components.get('graphics')
+            if graphics != None:
+                graphics.animate = True
+
+    def reset(self):
+        '''Brings every actor back to FULL.'''
+        for actor in self.levels.keys():
+            self._set_level(actor, FULL)
+        self._far_queue.clear()
+        self._queued.clear()
+
+    def update(self, dt, focus, collision_map):
+        self.time += dt
+        if not self.enabled or focus == None:
+            if self.far_actors or self.coarse:
+                self.reset()
+            return
+
+        # Work out the bands of everything near enough to matter. FAR
+        # actors are still where they were last caught up to, which is
+        # close enough to notice them coming into range.
+        x, y = focus.position
+        spatial_hash = self.layer.spatial_hash
+        near = spatial_hash.query(x - self.near, y - self.near, 2 * self.near,
+                2 * self.near)
+        in_range = spatial_hash.query(x - self.far, y - self.far, 2 * self.far,
+                2 * self.far)
+        levels = self.levels
+        for actor in in_range:
+            if actor in levels:
+                level = FULL if actor in near else COARSE
+                if levels[actor] != level:
+                    self._set_level(actor, level, collision_map)
+        for actor in self.active - in_range:
+            self._set_level(actor, FAR, collision_map)
+
+        self._step_coarse(dt, collision_map)
+        self._catch_up_far(dt, collision_map)
+
+    def _set_level(self, actor, level, collision_map=None):
+        old = self.levels[actor]
+        if old == level:
+            return
+        if old == FAR:
+            if collision_map != None:
+                self._catch_up(actor, collision_map)
+            del self.far_actors[actor]
+            self.active.add(actor)
+            # It may not have moved while catching up
+            self.layer.activity.wake(actor)
+        elif old == COARSE:
+            del self.coarse[actor]
+
+        self.levels[actor] = level
+        actor.components['physics'].lod = level
+        graphics = actor.components.get('graphics')
+        if level == FULL:
+            # Catch up on the triggers and the animation that were skipped
+            self.layer.dirty.add(actor)
+            if graphics != None:
+                graphics.animate = True
+                graphics.update_animation()
+                graphics.snap()
+        elif graphics != None:
+            graphics.animate = False
+
+        if level == COARSE:
+            self.coarse[actor] = 0.0
+        elif level == FAR:
+            self.active.discard(actor)
+            self.far_actors[actor] = self.time
+            # It may still be queued from the last time it was FAR
+            if actor not in self._queued:
+                self._queued.add(actor)
+                self._far_queue.append(actor)
+
+    def _step_coarse(self, dt, collision_map):
+        for actor, pending in self.coarse.items():
+            physics = actor.components['physics']
+            if physics._speed == 0 or (physics._dx == 0 and physics._dy == 0):
+                self.coarse[actor] = 0.0
+                continue
+            pending += dt
+            # Wait until there is about a tile to move
+            if pending * physics._speed * max(abs(physics._dx), abs(physics._dy)) < \
+                    collision_map.tile_width:
+                self.coarse[actor] = pending
+                continue
+            self.coarse[actor] = 0.0
+            self.advance(actor, pending, collision_map)
+
+    def _catch_up_far(self, dt, collision_map):
+        # Spread catching up over the interval rather than doing everyone at
+        # once
+        count = min(len(self._far_queue),
+                int(len(self.far_actors) * dt / self.interval) + 1)
+        for i in range(count):
+            actor = self._far_queue.popleft()
+            # Actors that left FAR since they were queued
+            if actor not in self.far_actors:
+                self._queued.discard(actor)
+                continue
+            self._catch_up(actor, collision_map)
+            self._far_queue.append(actor)
+
+    def _catch_up(self, actor, collision_map):
+        elapsed = self.time - self.far_actors[actor]
+        self.far_actors[actor] = self.time
+        self.advance(actor, elapsed, collision_map)
+
+    def advance(self, actor, seconds, collision_map):
+        '''Moves the actor as far as it would have gone in the given time,
+        at most about a tile per step so that it can't pass through walls.
+        '''
+        physics = actor.components['physics']
+        dirty = self.layer.dirty
+        was_dirty = actor in dirty
+        tile = collision_map.tile_width
+        for i in range(self.max_steps):
+            dx, dy, speed = physics._dx, physics._dy, physics._speed
+            if seconds <= 0 or speed == 0 or (dx == 0 and dy == 0):
+                break
+            step = min(seconds, float(tile) / (speed * max(abs(dx), abs(dy))))
+            seconds -= step
+            move_x, move_y = dx * speed * step, dy * speed * step
+            x, y = actor.x, actor.y
+            collide_x = collide_y = False
+            if physics._collidable:
+                if move_x != 0:
+                    collide_x = collision_map.collides(x + move_x, y,
+                            actor.width, actor.height)
+                if move_y != 0:
+                    collide_y = collision_map.collides(x, y + move_y,
+                            actor.width, actor.height)
+            if not collide_x:
+                x += move_x
+            if not collide_y:
+                y += move_y
+            if x != actor.x or y != actor.y:
+                actor.position = (x, y)
+            if collide_x or collide_y:
+                physics.dispatch_event('on_collision', collide_x, collide_y)
+        # Triggers are left to actors at FULL
+        if not was_dirty:
+            dirty.discard(actor)
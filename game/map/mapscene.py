@@ -7,6 +7,16 @@ from pyglet.window import key, mouse
 import cocos
 from cocos import tiles, actions, layer, rect, scenes
 
+from spatial import SpatialHash
+from physics import PhysicsSystem
+from scheduler import UpdateScheduler
+from activity import ActivitySystem
+from lod import SimulationLOD
+from ..actor.columns import ColumnStore
+from ..actor import events
+import chunked
+from ..profiler import profiler
+
 class State(layer.Layer):
     '''State actors control the tile engine.
     State actors register input events and perform their specific task.
@@ -164,10 +174,28 @@ class CinematicState(State):
             self.action = None
 
 class ActorLayer(cocos.layer.ScrollableLayer):
-    def __init__(self, id=''):
+    def __init__(self, id='', cell_size=64, columns=False):
         super(ActorLayer, self).__init__()
         self.id = id
         self.actors = {}
+        # Component type -> ColumnStore when components with columns are kept
+        # in column arrays for the systems, None otherwise
+        self.stores = {} if columns else None
+        # Ticks the components that have updates, one system at a time
+        self.scheduler = UpdateScheduler()
+        # Spatial index of actor bounding boxes, kept up to date by on_move
+        self.spatial_hash = SpatialHash(cell_size)
+        # Decides which actors are simulated at all
+        self.activity = ActivitySystem(self.scheduler, self.spatial_hash)
+        self._move_handlers = {}
+        # Actors that moved since the last trigger resolution pass
+        self.dirty = set()
+        # Simulates moving actors far from the focus in less detail, off
+        # until set_bands is called
+        self.lod = SimulationLOD(self)
+        # Events posted by the actors and their components, MapScene flushes
+        # it at the start of every simulation tick
+        self.queue = events.EventQueue()
         self.map_scene = None
         self.batch = cocos.batch.BatchNode()
         self.add(self.batch)
@@ -194,21 +222,49 @@ class ActorLayer(cocos.layer.ScrollableLayer):
             raise Exception('Duplicate actor name: %s' % actor.name)
 
         self.actors[actor.name] = actor
+        self.spatial_hash.add(actor, actor.x, actor.y, actor.width, actor.height)
+        self._move_handlers[actor] = self._make_move_handler(actor)
+        actor.push_handlers(on_move=self._move_handlers[actor])
+        self.dirty.add(actor)
+        actor.event_queue = self.queue
+        self.store_components(actor)
+        self.activity.add(actor)
+        self.lod.add(actor)
 
         if self.map_scene != None:
             actor.parent_map = self.map_scene
 
         if actor.has_component('graphics'):
-            self.batch.add(actor.get_component('graphics').sprite)
+            graphics = actor.get_component('graphics')
+            if graphics.sprite != None:
+                self.batch.add(graphics.sprite)
+            graphics.snap()
 
         actor.on_enter()
     
     def remove_actor(self, actor):
         del self.actors[actor.name]
+        self.spatial_hash.remove(actor)
+        actor.remove_handlers(on_move=self._move_handlers.pop(actor))
+        self.dirty.discard(actor)
+        # Events still waiting are about this map, so they go too
+        actor.event_queue = None
+        self.queue.discard(actor)
+        for component in actor.components.itervalues():
+            self.queue.discard(component)
+        self.release_components(actor)
+        self.activity.remove(actor)
+        self.lod.remove(actor)
+        # Quietly forget intersections so nothing points at the removed actor
+        for other in actor.intersect_actors:
+            other.intersect_actors.discard(actor)
+        actor.intersect_actors = weakref.WeakSet()
         actor.parent_map = None
 
         if actor.has_component('graphics'):
-            self.batch.remove(actor.get_component('graphics').sprite)
+            graphics = actor.get_component('graphics')
+            if graphics.sprite != None:
+                self.batch.remove(graphics.sprite)
 
         actor.on_exit()
 
@@ -219,21 +275,155 @@ class ActorLayer(cocos.layer.ScrollableLayer):
         return self.actors.values()
 
     def get_in_region(self, rect):
-        actors = weakref.WeakSet()
-        for a in self.actors.values():
-            actor_rect = cocos.rect.Rect(a.x, a.y, a.width, a.height)
-            if actor_rect.intersects(rect):
-                actors.add(a)
-        return actors
+        return weakref.WeakSet(self.spatial_hash.query(rect.x, rect.y,
+            rect.width, rect.height))
+
+    def get_store(self, component_type):
+        '''Returns the ColumnStore of a component type, or None if the layer
+        doesn't keep columns or has no such components.
+        '''
+        if self.stores == None:
+            return None
+        return self.stores.get(component_type)
+
+    def refresh_actor(self, actor):
+        '''Catches up with components added to or removed from an actor that
+        is already on the layer. Actor.refresh_components calls this.
+        '''
+        self.store_components(actor)
+        self.activity.refresh(actor)
+        self.lod.remove(actor)
+        self.lod.add(actor)
+
+    def resize_actor(self, actor):
+        '''Catches up with a change to the size of an actor on the layer.
+        Actor.size calls this.
+        '''
+        self.spatial_hash.update(actor, actor.x, actor.y, actor.width,
+                actor.height)
+        # It may overlap different actors now
+        self.dirty.add(actor)
+
+    def store_components(self, actor):
+        '''Gives every component of the actor that has columns a row in its
+        type's store. Components that already have one are left alone.
+        '''
+        if self.stores == None:
+            return
+        for component in actor.components.itervalues():
+            if not component.columns or component._store != None:
+                continue
+            store = self.stores.get(component.component_type)
+            if store == None:
+                store = ColumnStore(component.columns)
+                self.stores[component.component_type] = store
+            component._row = store.add(component)
+            component._store = store
+
+    def release_components(self, actor):
+        for component in actor.components.itervalues():
+            if component._store != None:
+                component._store.remove(component._row)
+                component._store = component._row = None
+
+    def _make_move_handler(self, actor):
+        # on_move doesn't say who moved, so each actor gets its own handler.
+        # Only a weak reference to the actor is kept to avoid a cycle.
+        spatial_hash = self.spatial_hash
+        dirty = self.dirty
+        activity = self.activity
+        sleeping = activity.sleeping
+        actor_ref = weakref.ref(actor)
+        if self.stores == None:
+            def on_move(x, y, rel_x, rel_y):
+                a = actor_ref()
+                spatial_hash.update(a, x, y, a.width, a.height)
+                dirty.add(a)
+                if a in sleeping:
+                    activity.wake(a)
+            return on_move
+
+        def on_move(x, y, rel_x, rel_y):
+            a = actor_ref()
+            spatial_hash.update(a, x, y, a.width, a.height)
+            dirty.add(a)
+            if a in sleeping:
+                activity.wake(a)
+            # Keep the position columns in step
+            for component in a.components.itervalues():
+                if component._store != None:
+                    component._store.set_position(component._row, x, y)
+        return on_move
+
+    def resolve_triggers(self):
+        '''Dispatches on_actor_enter and on_actor_exit for every pair of
+        actors whose intersection changed since the last call. Only actors
+        that moved are queried, and each pair is handled once no matter how
+        many of its members moved.
+        '''
+        if not self.dirty:
+            return
+
+        moved = list(self.dirty)
+        self.dirty.clear()
+
+        # frozenset((a, b)) -> (a, b) so each pair is reported once
+        enter_pairs = {}
+        exit_pairs = {}
+        for actor in moved:
+            found = self.spatial_hash.query(actor.x, actor.y, actor.width,
+                    actor.height)
+            found.discard(actor)
+            current = actor.intersect_actors
+            for other in found:
+                if other not in current:
+                    enter_pairs.setdefault(frozenset((actor, other)), (actor, other))
+            for other in current:
+                if other not in found:
+                    exit_pairs.setdefault(frozenset((actor, other)), (actor, other))
+
+        # Update intersection sets before any handler runs so that handlers
+        # see a consistent view of the map
+        for a, b in enter_pairs.itervalues():
+            a.intersect_actors.add(b)
+            b.intersect_actors.add(a)
+        for a, b in exit_pairs.itervalues():
+            a.intersect_actors.discard(b)
+            b.intersect_actors.discard(a)
+
+        for a, b in enter_pairs.itervalues():
+            a.dispatch_event('on_actor_enter', b)
+            b.dispatch_event('on_actor_enter', a)
+        for a, b in exit_pairs.itervalues():
+            a.dispatch_event('on_actor_exit', b)
+            b.dispatch_event('on_actor_exit', a)
+
+    def begin_tick(self):
+        '''Remembers where every sprite is before a simulation tick so that
+        interpolate can blend between ticks. Sleeping actors don't move, so
+        only awake ones are visited.
+        '''
+        for actor in self.activity.awake:
+            if actor.has_component('graphics'):
+                actor.get_component('graphics').begin_tick()
+
+    def interpolate(self, alpha):
+        '''Places every sprite alpha of the way between its position before
+        and after the last simulation tick.
+        '''
+        for actor in self.activity.awake:
+            if actor.has_component('graphics'):
+                actor.get_component('graphics').interpolate(alpha)
 
     def update(self, dt):
-        for actor in self.actors.values():
-            actor.update(dt)
+        self.scheduler.update(dt)
 
 class MapScene(cocos.scene.Scene):
     def __init__(self, width, height, tile_width, tile_height):
         super(MapScene, self).__init__()
         self.name = "Nowhere"
+        # Map number in the save file
+        self.mapnum = None
         # Map dimensions in tiles
         self.map_width = width
         self.map_height = height
@@ -246,37 +436,111 @@ class MapScene(cocos.scene.Scene):
         self.state = list()
         # Actor to focus on
         self.focus = None
+        # Moves every actor with a physics component
+        self.physics = PhysicsSystem()
+        # Simulation ticks per second. None runs one variable length tick per
+        # rendered frame.
+        self.tick_rate = None
+        # Most ticks run in one frame before the simulation gives up on
+        # catching up with real time
+        self.max_catchup = 5
+        self._accumulator = 0.0
+
+    def set_tick_rate(self, tick_rate, max_catchup=5):
+        '''Switches to a fixed simulation step of 1/tick_rate seconds. Passing
+        None goes back to stepping once per frame with the frame's dt.
+        '''
+        self.tick_rate = tick_rate
+        self.max_catchup = max_catchup
+        self._accumulator = 0.0
 
     def on_enter(self):
         super(MapScene, self).on_enter()
-        self.schedule(self.update)
+        self.schedule(self.step)
         #from sys import getrefcount
         #print "enter: " + str(getrefcount(self))
 
     def on_exit(self):
         super(MapScene, self).on_exit()
-        self.unschedule(self.update)
+        self.unschedule(self.step)
         #from sys import getrefcount
         #print "exit: " + str(getrefcount(self))
 
+    def step(self, dt):
+        '''Advances the simulation by dt seconds of real time. With a fixed
+        tick rate this runs as many whole ticks as fit into the accumulated
+        time and then interpolates sprites between the last two ticks.
+        '''
+        if self.tick_rate == None:
+            self.update(dt)
+            return
+
+        tick = 1.0 / self.tick_rate
+        self._accumulator += dt
+        ticks = 0
+        while self._accumulator >= tick:
+            if ticks == self.max_catchup:
+                # Too far behind, drop the time we can't make up
+                self._accumulator %= tick
+                break
+            self.actors.begin_tick()
+            self.update(tick)
+            self._accumulator -= tick
+            ticks += 1
+        self.actors.interpolate(self._accumulator / tick)
+
     def update(self, dt):
+        '''Runs a single simulation tick.'''
+        # Direction changes and other posted events since the last tick
+        self.actors.queue.flush()
+        activity = self.actors.activity
+        activity.set_region(self.active_region())
         self.actors.update(dt)
+        self.actors.lod.update(dt, self.focus, self.collision_map)
+        self.physics.step(dt, activity.awake, self.collision_map,
+                self.actors.get_store('physics'))
+        self.actors.resolve_triggers()
+        activity.settle()
+
+    def active_region(self):
+        '''Returns (x, y, width, height) of the part of the map in view, or
+        of a window sized area around the focus if nothing has been drawn
+        yet. None if there is no focus.
+        '''
+        if self.actors.view_w > 0:
+            actors = self.actors
+            return (actors.view_x, actors.view_y, actors.view_w, actors.view_h)
+        if self.focus == None:
+            return None
+        width, height = cocos.director.director.get_window_size()
+        x, y = self.focus.position
+        return (x - width // 2, y - height // 2, width, height)
 
     def do_focus(self):
         if self.focus != None:
-            self.scroller.set_focus(self.focus.x, self.focus.y)
+            x, y = self.focus.position
+            # Follow the sprite rather than the simulation so the camera
+            # doesn't jitter when interpolating
+            if self.tick_rate != None and self.focus.has_component('graphics'):
+                x, y = self.focus.get_component('graphics').render_position
+            self.scroller.set_focus(x, y)
 
     def visit(self):
+        # Start counting this frame's tile draw calls
+        chunked.draw_counter.frame()
         # For some reason this is the only way to the map scroll smoothly
         self.do_focus()
         super(MapScene, self).visit()
+        if profiler.overlay != None:
+            profiler.overlay.draw()
 
-    def init_layers(self, ground, fringe, over, collision, actors):
+    def init_layers(self, ground, fringe, over, collision, actors, collision_map):
         # Set member variables
         self.ground = ground
         self.fringe = fringe
         self.over = over
         self.collision = collision
+        self.collision_map = collision_map
         self.actors = actors
         self.actors.map_scene = self
         # Create a scrolling manager for the map layers
@@ -287,6 +551,15 @@ class MapScene(cocos.scene.Scene):
         self.scroller.add(self.over, name='over', z=3)
         self.add(self.scroller, name='scroller')
 
+    def init_headless(self, collision_map, actors):
+        '''Headless counterpart of init_layers. Only the actors and the
+        collision map are kept since nothing will ever be drawn.
+        '''
+        self.ground = self.fringe = self.over = self.collision = None
+        self.collision_map = collision_map
+        self.actors = actors
+        self.actors.map_scene = self
+
     def state_replace(self, new_state):
         # Remove old state is there was one and suppress the exception
         try:
@@ -0,0 +1,161 @@
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class PhysicsSystem(object):
+    '''Steps every PhysicsComponent on a map in one batch. Positions,
+    velocities, speeds and sizes of the moving actors are packed into NumPy
+    arrays so that integration and collision testing against the map's
+    CollisionMap happen for all of them at once. If NumPy isn't installed
+    the same step is done one actor at a time.
+
+    Afterwards positions are written back with a single position assignment
+    per actor, so on_move is only dispatched for actors that actually moved
+    and on_collision only for actors that ran into something.
+
+    When the map keeps physics components in a ColumnStore the arrays are
+    taken straight from its columns instead of being gathered actor by
+    actor.
+
+    Actors simulated at a lower level of detail are left to the map's
+    SimulationLOD.
+    '''
+    def __init__(self, use_numpy=True):
+        self.use_numpy = use_numpy and numpy != None
+
+    def step(self, dt, actors, collision_map, store=None):
+        if store != None and self.use_numpy:
+            self._step_columns(dt, store, collision_map)
+            return
+
+        # Only actors that are trying to move need any work
+        if store != None:
+            candidates = [(physics.owner, physics) for physics in store.owners]
+        else:
+            candidates = [(actor, actor.components.get('physics')) for actor in actors]
+        bodies = []
+        for actor, physics in candidates:
+            if physics != None and physics._speed != 0 and physics._lod == 0 and \
+                    (physics._dx != 0 or physics._dy != 0):
+                bodies.append((actor, physics))
+
+        if not bodies:
+            return
+
+        if self.use_numpy:
+            results = self._step_numpy(dt, bodies, collision_map)
+        else:
+            results = self._step_python(dt, bodies, collision_map)
+
+        self._write_back(bodies, results)
+
+    def _write_back(self, bodies, results):
+        for (actor, physics), (x, y, collide_x, collide_y) in zip(bodies, results):
+            if x != actor.x or y != actor.y:
+                actor.position = (x, y)
+            if collide_x or collide_y:
+                physics.dispatch_event('on_collision', collide_x, collide_y)
+
+    def _step_columns(self, dt, store, collision_map):
+        dx, dy = store.column('dx'), store.column('dy')
+        speed = store.column('speed')
+        rows = numpy.nonzero((speed != 0) & (store.column('lod') == 0) &
+                ((dx != 0) | (dy != 0)))[0]
+        if not len(rows):
+            return
+
+        # Indexing with rows copies, so handlers changing components while
+        # results are written back don't disturb them
+        x, y = store.column('x')[rows], store.column('y')[rows]
+        width, height = store.column('width')[rows], store.column('height')[rows]
+        collidable = store.column('collidable')[rows] != 0
+        move_x = dx[rows] * speed[rows] * dt
+        move_y = dy[rows] * speed[rows] * dt
+
+        collide_x = collidable & (move_x != 0) & \
+                collides(collision_map, x + move_x, y, width, height)
+        collide_y = collidable & (move_y != 0) & \
+                collides(collision_map, x, y + move_y, width, height)
+
+        new_x = numpy.where(collide_x, x, x + move_x)
+        new_y = numpy.where(collide_y, y, y + move_y)
+        owners = store.owners
+        bodies = [(owners[row].owner, owners[row]) for row in rows.tolist()]
+        self._write_back(bodies, zip(new_x.tolist(), new_y.tolist(),
+            collide_x.tolist(), collide_y.tolist()))
+
+    def _step_python(self, dt, bodies, collision_map):
+        results = []
+        for actor, physics in bodies:
+            move_x = physics._dx * physics._speed * dt
+            move_y = physics._dy * physics._speed * dt
+            x, y = actor.x, actor.y
+            collide_x = collide_y = False
+            if physics._collidable:
+                if move_x != 0:
+                    collide_x = collision_map.collides(x + move_x, y,
+                            actor.width, actor.height)
+                if move_y != 0:
+                    collide_y = collision_map.collides(x, y + move_y,
+                            actor.width, actor.height)
+            if not collide_x:
+                x += move_x
+            if not collide_y:
+                y += move_y
+            results.append((x, y, collide_x, collide_y))
+        return results
+
+    def _step_numpy(self, dt, bodies, collision_map):
+        n = len(bodies)
+        position = numpy.empty((n, 2))
+        velocity = numpy.empty((n, 2))
+        size = numpy.empty((n, 2))
+        collidable = numpy.empty(n, dtype=bool)
+        for k, (actor, physics) in enumerate(bodies):
+            position[k] = actor.x, actor.y
+            velocity[k] = physics._dx * physics._speed, physics._dy * physics._speed
+            size[k] = actor.width, actor.height
+            collidable[k] = physics._collidable
+
+        move = velocity * dt
+        x, y = position[:, 0], position[:, 1]
+        width, height = size[:, 0], size[:, 1]
+
+        collide_x = collidable & (move[:, 0] != 0) & \
+                collides(collision_map, x + move[:, 0], y, width, height)
+        collide_y = collidable & (move[:, 1] != 0) & \
+                collides(collision_map, x, y + move[:, 1], width, height)
+
+        new_x = numpy.where(collide_x, x, x + move[:, 0])
+        new_y = numpy.where(collide_y, y, y + move[:, 1])
+        return zip(new_x.tolist(), new_y.tolist(), collide_x.tolist(),
+                collide_y.tolist())
+
+def collides(collision_map, x, y, width, height):
+    '''Vectorized CollisionMap.collides. Takes arrays of boxes and returns a
+    boolean array that is True for every box touching a solid tile.
+    '''
+    solid = numpy.frombuffer(collision_map.solid, dtype=numpy.uint8).reshape(
+            collision_map.height, collision_map.width)
+    tw, th = collision_map.tile_width, collision_map.tile_height
+
+    left = numpy.maximum(0, numpy.floor(x / tw)).astype(int)
+    bottom = numpy.maximum(0, numpy.floor(y / th)).astype(int)
+    right = numpy.minimum(collision_map.width, numpy.floor((x + width) / tw).astype(int) + 1)
+    top = numpy.minimum(collision_map.height, numpy.floor((y + height) / th).astype(int) + 1)
+    span_x = right - left
+    span_y = top - bottom
+
+    hit = numpy.zeros(len(x), dtype=bool)
+    if len(x) == 0 or span_x.max() <= 0 or span_y.max() <= 0:
+        return hit
+
+    # Boxes are small compared to tiles, so loop over tile offsets within a
+    # box and test every box at that offset at once
+    for di in range(span_x.max()):
+        i = numpy.clip(left + di, 0, collision_map.width - 1)
+        for dj in range(span_y.max()):
+            j = numpy.clip(bottom + dj, 0, collision_map.height - 1)
+            hit |= (di < span_x) & (dj < span_y) & (solid[j, i] != 0)
+    return hit
@@ -0,0 +1,94 @@
+class SpatialHash(object):
+    '''A uniform grid that buckets rectangles by the cells they overlap.
+    Region queries only look at the buckets that the region covers instead
+    of testing every object in the map.
+
+    Rectangles are treated the same way cocos.rect.Rect.intersects treats
+    them: edges that touch count as an intersection.
+    '''
+    def __init__(self, cell_size=64):
+        self.cell_size = cell_size
+        # (column, row) -> set of objects
+        self.buckets = {}
+        # object -> (x, y, width, height, keys)
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, obj):
+        return obj in self.entries
+
+    def _keys(self, x, y, width, height):
+        size = self.cell_size
+        left = int(x // size)
+        bottom = int(y // size)
+        right = int((x + width) // size)
+        top = int((y + height) // size)
+        return [(i, j) for i in range(left, right + 1)
+                for j in range(bottom, top + 1)]
+
+    def add(self, obj, x, y, width, height):
+        '''Inserts obj with the given bounding box. If obj is already in the
+        hash then its bounding box is updated instead.
+        '''
+        if obj in self.entries:
+            self.update(obj, x, y, width, height)
+            return
+
+        keys = self._keys(x, y, width, height)
+        for key in keys:
+            self.buckets.setdefault(key, set()).add(obj)
+        self.entries[obj] = (x, y, width, height, keys)
+
+    def update(self, obj, x, y, width, height):
+        '''Moves obj to a new bounding box. Buckets are only touched when
+        the set of overlapped cells actually changes.
+        '''
+        old_keys = self.entries[obj][4]
+        keys = self._keys(x, y, width, height)
+        if keys != old_keys:
+            self._discard(obj, old_keys)
+            for key in keys:
+                self.buckets.setdefault(key, set()).add(obj)
+        self.entries[obj] = (x, y, width, height, keys)
+
+    def remove(self, obj):
+        '''Removes obj from the hash. A KeyError is raised if obj is not in
+        the hash.
+        '''
+        self._discard(obj, self.entries.pop(obj)[4])
+
+    def _discard(self, obj, keys):
+        buckets = self.buckets
+        for key in keys:
+            bucket = buckets[key]
+            bucket.discard(obj)
+            if not bucket:
+                del buckets[key]
+
+    def clear(self):
+        self.buckets.clear()
+        self.entries.clear()
+
+    def query(self, x, y, width, height):
+        '''Returns the set of objects whose bounding box intersects the given
+        region.
+        '''
+        right = x + width
+        top = y + height
+        entries = self.entries
+        buckets = self.buckets
+        result = set()
+        for key in self._keys(x, y, width, height):
+            bucket = buckets.get(key)
+            if bucket is None:
+                continue
+            for obj in bucket:
+                if obj in result:
+                    continue
+                ox, oy, ow, oh, keys = entries[obj]
+                if ox > right or ox + ow < x or oy > top or oy + oh < y:
+                    continue
+                result.add(obj)
+        return result
@@ -0,0 +1,82 @@
+'''Tile layer data as arrays of gids. Tmx files and compiled maps both store
+gids as little-endian uint32s, one per tile, top row first. With NumPy the
+arrays are read-only views straight onto the decoded string or memory-mapped
+file and a layer's grid is a (height, width) view of the same memory.
+Without NumPy they are array.arrays with native byte order, which costs a
+copy.
+'''
+import sys
+import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Item type of array.array that is 4 bytes wide on this platform
+if array.array('I').itemsize == 4:
+    ARRAY_TYPE = 'I'
+else:
+    ARRAY_TYPE = 'L'
+
+def from_string(buf, count, offset=0):
+    '''Returns count gids stored in buf starting at byte offset. buf can be
+    anything that supports the buffer interface such as a str or an mmap.
+    '''
+    if numpy != None:
+        return numpy.frombuffer(buf, dtype='<u4', count=count, offset=offset)
+
+    gids = array.array(ARRAY_TYPE)
+    gids.fromstring(buffer(buf, offset, count * 4))
+    if sys.byteorder == 'big':
+        gids.byteswap()
+    return gids
+
+def from_list(values):
+    '''Returns gids from a sequence of ints.'''
+    if numpy != None:
+        return numpy.array(values, dtype='<u4')
+    return array.array(ARRAY_TYPE, values)
+
+def to_string(gids):
+    '''Returns gids as a string of little-endian uint32s.'''
+    if numpy != None:
+        return numpy.asarray(gids, dtype='<u4').tostring()
+
+    gids = array.array(ARRAY_TYPE, gids)
+    if sys.byteorder == 'big':
+        gids.byteswap()
+    return gids.tostring()
+
+def grid(gids, width, height):
+    '''Returns gids as a sequence of rows, top row first. This is a view
+    with NumPy and a list of arrays without it.
+    '''
+    if numpy != None:
+        return numpy.asarray(gids).reshape(height, width)
+    return [gids[j * width:(j + 1) * width] for j in range(height)]
+
+def rows(gids, width, height):
+    '''Returns gids as a list of lists of ints, top row first. Converting
+    everything at once is a lot cheaper than pulling gids out of an array
+    one at a time.
+    '''
+    return block(grid(gids, width, height), 0, 0, width, height)
+
+def solid(gids, width, height):
+    '''Returns a bytearray with 1 for every non-zero gid and 0 for the rest,
+    bottom row first.
+    '''
+    if numpy != None:
+        return bytearray((grid(gids, width, height)[::-1] != 0).astype(numpy.uint8).tostring())
+    return bytearray(1 if gid != 0 else 0
+            for row in reversed(rows(gids, width, height)) for gid in row)
+
+def block(grid, left, top, width, height):
+    '''Returns a width by height block of a grid as a list of lists of ints,
+    starting at row top and column left. Rows are counted from the top like
+    in the grid itself.
+    '''
+    if numpy != None:
+        return grid[top:top + height, left:left + width].tolist()
+    return [row[left:left + width].tolist() for row in grid[top:top + height]]
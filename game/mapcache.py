@@ -0,0 +1,67 @@
+import collections
+import threading
+
+class MapCache(object):
+    '''Least recently used cache of parsed maps. Entries are keyed by map name
+    and the modification time of the map file so an edited map is parsed
+    again instead of coming back stale. The cache may be read from the map
+    prefetcher's worker thread, so all access goes through a lock.
+    '''
+    def __init__(self, size):
+        # Most maps that are kept around at once
+        self.size = size
+        self.maps = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.maps)
+
+    def __contains__(self, name):
+        return name in self.maps
+
+    def get(self, name, mtime):
+        '''Returns the cached MapData for the named map, or None if it isn't
+        cached or was parsed from an older version of the file.
+        '''
+        with self.lock:
+            data = self.maps.get(name)
+            if data == None or data.mtime != mtime:
+                self.misses += 1
+                return None
+
+            # Move to the most recently used end
+            del self.maps[name]
+            self.maps[name] = data
+            self.hits += 1
+            return data
+
+    def peek(self, name, mtime):
+        '''Same as get but doesn't count towards the statistics or mark the
+        map as recently used.
+        '''
+        with self.lock:
+            data = self.maps.get(name)
+            if data == None or data.mtime != mtime:
+                return None
+            return data
+
+    def put(self, data):
+        '''Adds parsed map data, replacing any older version of the same map
+        and evicting the least recently used maps if the cache is full.
+        '''
+        with self.lock:
+            if data.name in self.maps:
+                del self.maps[data.name]
+            self.maps[data.name] = data
+            while len(self.maps) > self.size:
+                self.maps.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.maps.clear()
+
+    def stats(self):
+        '''Returns (hits, misses, number of cached maps).'''
+        return (self.hits, self.misses, len(self.maps))
@@ -0,0 +1,220 @@
+'''Compiles tmx maps into a binary format that loads without any XML
+parsing or decoding:
+
+    python -m game.mapcompile [maps/outside.tmx ...]
+
+Maps are named the same way as in the map table of the save file. With no
+arguments every map in data/maps is compiled. Compiled maps are
+written next to the tmx file with a .map extension and are picked up by
+mapload automatically. They remember the modification time of the tmx file
+they came from, so editing a map makes mapload fall back to the tmx file
+until the map is compiled again.
+
+File layout, all little-endian:
+
+    header        see HEADER
+    layer data    one uint32 gid per tile, top row first, per layer
+    collision     one byte per tile, bottom row first, see CollisionMap
+    table         tilesets, layers and object groups with their objects
+
+Strings in the table are a uint16 byte length followed by UTF-8 bytes, with
+a length of 0xffff standing for None.
+'''
+import os
+import sys
+import mmap
+import struct
+import glob
+
+MAGIC = 'RPGM'
+VERSION = 1
+
+# magic, version, tmx mtime, map width, map height, tile width,
+# tile height, tileset count, layer count, object group count, collision
+# offset (0 if the map has no collision layer), table offset
+HEADER = struct.Struct('<4sHxxdIIIIIIIII')
+TILESET = struct.Struct('<IHHII')
+LAYER = struct.Struct('<III')
+GROUP = struct.Struct('<III')
+OBJECT = struct.Struct('<iiIIH')
+STRING = struct.Struct('<H')
+NONE_STRING = 0xffff
+
+def compiled_path(path):
+    '''Returns where the compiled version of a tmx file lives.'''
+    return os.path.splitext(path)[0] + '.map'
+
+def pack_string(s):
+    if s == None:
+        return STRING.pack(NONE_STRING)
+    s = s.encode('utf-8')
+    return STRING.pack(len(s)) + s
+
+def unpack_string(buf, offset):
+    length, = STRING.unpack_from(buf, offset)
+    offset += STRING.size
+    if length == NONE_STRING:
+        return None, offset
+    if offset + length > len(buf):
+        raise struct.error('string runs past the end of the file')
+    return buf[offset:offset + length].decode('utf-8'), offset + length
+
+def compile_map(filename):
+    '''Compiles a map file. Returns the path of the compiled map.'''
+    import mapload
+    from map import tiledata
+    import util.resource
+
+    path = util.resource.resource_path(filename)
+    out_path = compiled_path(path)
+    mtime = os.path.getmtime(path)
+    data = mapload.parse_map(None, None, filename, mtime)
+
+    # Layer data and the collision map go straight after the header, they
+    # are all multiples of 4 bytes long except for the collision map so it
+    # goes last
+    sections = []
+    offset = HEADER.size
+    layer_offsets = []
+    for layer in data.layers:
+        layer_offsets.append(offset)
+        sections.append(tiledata.to_string(layer.data))
+        offset += len(sections[-1])
+    collision_offset = 0
+    if data.collision_map != None:
+        collision_offset = offset
+        sections.append(str(data.collision_map.solid))
+        offset += len(sections[-1])
+    table_offset = offset
+
+    # Table
+    for tileset in data.tilesets:
+        sections.append(TILESET.pack(tileset.firstgid, tileset.tile_width,
+            tileset.tile_height, tileset.image_width, tileset.image_height))
+        sections.append(pack_string(tileset.name))
+        sections.append(pack_string(tileset.source))
+    for layer, layer_offset in zip(data.layers, layer_offsets):
+        sections.append(LAYER.pack(layer.width, layer.height, layer_offset))
+        sections.append(pack_string(layer.name))
+    for group in data.object_groups:
+        sections.append(GROUP.pack(group.width, group.height, len(group.objects)))
+        sections.append(pack_string(group.name))
+        for obj in group.objects:
+            sections.append(OBJECT.pack(obj.x, obj.y, obj.width, obj.height,
+                len(obj.properties)))
+            sections.append(pack_string(obj.name))
+            sections.append(pack_string(obj.type))
+            for name, value in sorted(obj.properties.items()):
+                sections.append(pack_string(name))
+                sections.append(pack_string(value))
+
+    header = HEADER.pack(MAGIC, VERSION, mtime, data.width, data.height,
+            data.tile_width, data.tile_height, len(data.tilesets),
+            len(data.layers), len(data.object_groups), collision_offset,
+            table_offset)
+
+    # Write to a temporary file first so the game never sees half a map
+    tmp_path = out_path + '.tmp'
+    f = open(tmp_path, 'wb')
+    try:
+        f.write(header)
+        for section in sections:
+            f.write(section)
+    finally:
+        f.close()
+    os.rename(tmp_path, out_path)
+    return out_path
+
+def load_compiled(mapname, mapnum, filename, mtime):
+    '''Loads the compiled version of a map file into a MapData. mtime is the
+    modification time of the tmx file. Returns None if there is no compiled
+    map or it is out of date, in which case the tmx file has to be parsed.
+    Raises struct.error if the file is cut short and ValueError if its
+    strings are garbage.
+    '''
+    import mapload
+    from map import tiledata
+    from map.collision import CollisionMap
+    import util.resource
+
+    path = compiled_path(util.resource.resource_path(filename))
+    # Empty files can't be mapped
+    if not os.path.exists(path) or os.path.getsize(path) < HEADER.size:
+        return None
+
+    f = open(path, 'rb')
+    try:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        f.close()
+    # The mmap is closed once nothing uses it any more. With NumPy the
+    # layer data points straight into it.
+    (magic, version, tmx_mtime, width, height, tile_width, tile_height,
+            tileset_count, layer_count, group_count, collision_offset,
+            offset) = HEADER.unpack_from(buf, 0)
+    if magic != MAGIC or version != VERSION or tmx_mtime != mtime:
+        return None
+
+    data = mapload.MapData(mapname, mapnum, filename, mtime)
+    data.width, data.height = width, height
+    data.tile_width, data.tile_height = tile_width, tile_height
+
+    for i in range(tileset_count):
+        firstgid, tw, th, iw, ih = TILESET.unpack_from(buf, offset)
+        offset += TILESET.size
+        name, offset = unpack_string(buf, offset)
+        source, offset = unpack_string(buf, offset)
+        data.tilesets.append(mapload.TilesetData(firstgid, name, tw, th,
+            source, iw, ih))
+
+    for i in range(layer_count):
+        layer_width, layer_height, data_offset = LAYER.unpack_from(buf, offset)
+        offset += LAYER.size
+        name, offset = unpack_string(buf, offset)
+        # Slicing the layer data doesn't notice a short file by itself
+        if data_offset + layer_width * layer_height * 4 > len(buf):
+            raise struct.error('layer %s runs past the end of the file' % name)
+        data.layers.append(mapload.LayerData(name, layer_width,
+            layer_height, tiledata.from_string(buf,
+                layer_width * layer_height, data_offset)))
+
+    if collision_offset != 0:
+        if collision_offset + width * height > len(buf):
+            raise struct.error('collision map runs past the end of the file')
+        data.collision_map = CollisionMap(width, height, tile_width,
+                tile_height, bytearray(buf[collision_offset:collision_offset + width * height]))
+
+    for i in range(group_count):
+        group_width, group_height, object_count = GROUP.unpack_from(buf, offset)
+        offset += GROUP.size
+        name, offset = unpack_string(buf, offset)
+        group = mapload.ObjectGroupData(name, group_width, group_height)
+        for j in range(object_count):
+            x, y, w, h, property_count = OBJECT.unpack_from(buf, offset)
+            offset += OBJECT.size
+            name, offset = unpack_string(buf, offset)
+            type, offset = unpack_string(buf, offset)
+            obj = mapload.ObjectData(name, type)
+            obj.x, obj.y, obj.width, obj.height = x, y, w, h
+            for k in range(property_count):
+                key, offset = unpack_string(buf, offset)
+                value, offset = unpack_string(buf, offset)
+                obj.properties[key] = value
+            group.objects.append(obj)
+        data.object_groups.append(group)
+    return data
+
+def main(filenames):
+    import headless
+    headless.init()
+
+    if not filenames:
+        maps = os.path.join(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__))), 'data', 'maps')
+        filenames = ['maps/' + os.path.basename(path)
+                for path in sorted(glob.glob(os.path.join(maps, '*.tmx')))]
+    for filename in filenames:
+        print '%s -> %s' % (filename, compile_map(filename))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -4,41 +4,173 @@ except ImportError:
     import elementtree.ElementTree as ElementTree
 
 import os
+import sys
 import base64
+import struct
+import traceback
 import zlib
-import array
 import pyglet
-from pyglet.gl import *
 import cocos
 
 import util
+import util.atlas
+import util.resource
 from map import mapscene
+from map import tiledata
+from map import chunked
+from map.collision import CollisionMap
+from mapcache import MapCache
+import mapcompile
+from prefetch import MapPrefetcher
+from pipeline import LoaderPool
 from game import game
 
 class TileSet(list):
     pass
 
 class AnimSet(dict):
-    pass
+    '''Animations from an animset file, keyed by name. Animsets are shared by
+    every actor that loads the same file, so they are read-only.
+    '''
+    def __init__(self, anims=(), image=None, image_size=(0, 0)):
+        dict.__init__(self, anims)
+        # Resource name and size of the image the frames come from
+        self.image = image
+        self.image_size = image_size
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('AnimSet is shared and cannot be modified')
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _read_only
+
+class TilesetData(object):
+    '''Description of a tileset image as found in a map file.'''
+    def __init__(self, firstgid, name, tile_width, tile_height, source, image_width, image_height):
+        self.firstgid = firstgid
+        self.name = name
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        self.source = source
+        self.image_width = image_width
+        self.image_height = image_height
+
+class LayerData(object):
+    '''Decoded tile layer. data holds one gid per tile, top row first, see
+    map.tiledata.
+    '''
+    def __init__(self, name, width, height, data):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.data = data
+
+    @property
+    def grid(self):
+        '''The layer's gids as rows, top row first.'''
+        return tiledata.grid(self.data, self.width, self.height)
+
+class ObjectData(object):
+    '''An object from an object layer, with y already flipped so that it
+    points up like everything else in cocos.
+    '''
+    def __init__(self, name, type):
+        self.name = name
+        self.type = type
+        self.x = self.y = 0
+        self.width = self.height = 0
+        self.properties = {}
+
+class ObjectGroupData(object):
+    def __init__(self, name, width, height):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.objects = []
+
+class MapData(object):
+    '''Everything parsed out of a map file. This is what the map cache
+    holds, so it must not be modified once parse_map returns, with the
+    exception of tileset, which build_map fills in the first time the map is
+    shown.
+    '''
+    def __init__(self, name, mapnum, filename, mtime):
+        self.name = name
+        self.mapnum = mapnum
+        self.filename = filename
+        # Modification time of the map file when it was parsed
+        self.mtime = mtime
+        # Map dimensions in tiles
+        self.width = self.height = 0
+        # Tile dimensions in pixels
+        self.tile_width = self.tile_height = 0
+        self.tilesets = []
+        self.layers = []
+        self.object_groups = []
+        self.collision_map = None
+        # Tiles sliced from the tileset images, see build_map
+        self.tileset = None
 
 class MapException(Exception):
     pass
 
+# Loaded animsets, keyed by file name
+animsets = dict()
+
 def load_animset(filename):
+    '''Returns the animset in the given file. Files are only read once, later
+    calls return the same shared AnimSet.
+    '''
+    if filename not in animsets:
+        animsets[filename] = read_animset(filename)
+    return animsets[filename]
+
+def invalidate_animset(filename=None):
+    '''Forgets a loaded animset so that the next load_animset reads the file
+    again. Forgets every animset if no filename is given. Actors keep using
+    the animations they already have.
+    '''
+    if filename == None:
+        animsets.clear()
+    else:
+        animsets.pop(filename, None)
+
+def animset_footprint():
+    '''Returns a dictionary describing how much memory loaded animsets use.
+    texture_bytes counts each source image once at 4 bytes per pixel.
+    '''
+    images = dict()
+    animations = frames = 0
+    for anims in animsets.values():
+        images[anims.image] = anims.image_size
+        animations += len(anims)
+        for anim in anims.values():
+            if anim != None:
+                frames += len(anim.frames)
+    return {'animsets': len(animsets),
+            'animations': animations,
+            'frames': frames,
+            'texture_bytes': sum(w * h * 4 for w, h in images.values())}
+
+def read_animset(filename):
     # Open xml file
     root = ElementTree.parse(util.resource.resource_path(filename)).getroot()
     if root.tag != 'animset':
         raise MapException('Expected <animset> tag, found <%s> tag' % root.tag)
 
+    # Headless actors only need to know which animations exist
+    if game.headless:
+        return AnimSet((child.get('name'), None) for child in root.findall('anim'))
+
     # Get animset properties
-    image = pyglet.resource.image('anims/' + root.get('image'))
+    source = 'anims/' + root.get('image')
+    image = util.atlas.image(source)
     tile_width = int(root.get('tilewidth'))
     tile_height = int(root.get('tileheight'))
 
     # Create image sequence of tiles
     grid = pyglet.image.ImageGrid(image, image.width / tile_width, image.height / tile_height)
     sequence = grid.get_texture_sequence()
-    anims = AnimSet()
+    anims = dict()
 
     # Loop through all animations
     for child in root.findall('anim'):
@@ -49,16 +181,16 @@ def load_animset(filename):
         for f in frame_indices:
             frames.append(sequence[f])
         anims[anim_name] = pyglet.image.Animation.from_image_sequence(frames, anim_duration, loop=True)
-    return anims
+    return AnimSet(anims, source, (image.width, image.height))
 
 def load_image(tag):
     # Get image properties
     source = tag.get('source')
     width = int(tag.get('width'))
     height = int(tag.get('height'))
-    return pyglet.resource.image(source), width, height
+    return source, width, height
 
-def load_tileset(tag):
+def parse_tileset(tag):
     # Get tileset properties
     firstgid = int(tag.get('firstgid'))
     name = tag.get('name')
@@ -69,8 +201,21 @@ def load_tileset(tag):
     # Raise an exception if child tag is not <image>
     if child.tag != 'image':
         raise MapException('Unsupported tag in tileset: %s' % child.tag)
-    # Load image
-    image, image_width, image_height  = load_image(child)
+    source, image_width, image_height = load_image(child)
+    return TilesetData(firstgid, name, tile_width, tile_height, source, image_width, image_height)
+
+# Sliced tilesets shared by every map, keyed by image source and tile size
+tilesets = dict()
+
+def load_tileset(data):
+    key = (data.source, data.tile_width, data.tile_height)
+    if key in tilesets:
+        return tilesets[key]
+
+    # Load image into the shared atlas. Texture clamping is set up there.
+    image = util.atlas.image(data.source)
+    image_width, image_height = data.image_width, data.image_height
+    tile_width, tile_height = data.tile_width, data.tile_height
 
     # Construct tileset
     tileset = TileSet()
@@ -78,12 +223,7 @@ def load_tileset(tag):
         for x in range(0, image_width, tile_width):
             tile = image.get_region(x, image_height - y - tile_height, tile_width, tile_height)
             tileset.append(cocos.tiles.Tile(y * (image_width / tile_width) + x, None, tile))
-            # set texture clamping to avoid mis-rendering subpixel edges
-            # Borrowed from cocos2d tiles.py
-            tile.texture.id
-            glBindTexture(tile.texture.target, tile.texture.id)
-            glTexParameteri(tile.texture.target, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
-            glTexParameteri(tile.texture.target, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+    tilesets[key] = tileset
     return tileset
 
 factories = dict()
@@ -93,18 +233,121 @@ def register_actor_factory(name):
         return func
     return decorate
 
-def load_map(mapname):
+# Parsed maps, keyed by map name and file modification time
+map_cache = MapCache(8)
+
+def lookup_map(db, mapname):
+    '''Returns the map number and map file of the named map.'''
     # Get map file from database
-    cursor = game.db.cursor()
-    cursor.execute('SELECT mapnum, file FROM map WHERE name=?', (mapname,))
+    row = db.query_one('map', (mapname,))
 
     # Raise exception if the map is not found
-    row = cursor.fetchone()
     if row == None:
         raise MapException('Map %s not found in database' % mapname)
-    mapnum = row['mapnum']
-    filename = row['file']
+    return row['mapnum'], row['file']
+
+def load_map(mapname):
+    # Pick up anything the prefetcher finished since the last frame
+    prefetcher.poll()
+    # The map may have actors with changes that haven't been saved yet
+    if game.checkpoint != None:
+        game.checkpoint.flush()
+
+    mapnum, filename = lookup_map(game.db, mapname)
+
+    # Actor rows fetched ahead of time are only good for the next map load,
+    # after that the game may have changed them
+    actor_rows = prefetched_actors.pop(mapname, None)
+    prefetched_actors.clear()
+    # Otherwise fetch them on a worker while the map file is read
+    pending_rows = None
+    if actor_rows == None and loader_pool != None:
+        pending_rows = loader_pool.query(game.db_filename, fetch_actors, mapnum)
+
+    # Only parse the map file if it isn't cached or has changed on disk
+    mtime = os.path.getmtime(util.resource.resource_path(filename))
+    data = map_cache.get(mapname, mtime)
+    if data == None:
+        data = read_map(mapname, mapnum, filename, mtime, loader_pool)
+        map_cache.put(data)
+
+    if pending_rows != None:
+        actor_rows = pending_rows.get()
+
+    map_scene = build_map(data, actor_rows)
+
+    # Get the maps that portals lead to ready in the background
+    for group in data.object_groups:
+        for obj in group.objects:
+            if obj.type == 'portal' and 'map' in obj.properties:
+                prefetcher.prefetch(game.db_filename, obj.properties['map'])
+
+    return map_scene
 
+# Actor rows of prefetched maps, keyed by map name
+prefetched_actors = dict()
+
+def prefetch_map(db, mapname):
+    '''Runs on the prefetcher's worker thread with its own database
+    connection. Does the parts of load_map that don't need OpenGL.
+    '''
+    mapnum, filename = lookup_map(db, mapname)
+    mtime = os.path.getmtime(util.resource.resource_path(filename))
+    data = map_cache.peek(mapname, mtime)
+    if data == None:
+        data = read_map(mapname, mapnum, filename, mtime)
+    return data, fetch_actors(db, mapnum)
+
+def finish_prefetch(result):
+    '''Runs on the main thread once a prefetched map is ready. Slicing
+    tilesets needs the OpenGL context so it is done here.
+    '''
+    data, actor_rows = result
+    if map_cache.peek(data.name, data.mtime) == None:
+        map_cache.put(data)
+    if not game.headless:
+        load_tilesets(data)
+    prefetched_actors[data.name] = actor_rows
+
+prefetcher = MapPrefetcher(prefetch_map, finish_prefetch, game.open_db)
+
+# Worker threads for load_map, see start_loader_pool
+loader_pool = None
+
+def start_loader_pool(workers):
+    '''Spreads the parts of load_map that don't need OpenGL over the given
+    number of worker threads. Tilesets are still uploaded on the main
+    thread.
+    '''
+    global loader_pool
+    if loader_pool != None:
+        loader_pool.close()
+        loader_pool = None
+    if workers > 0:
+        loader_pool = LoaderPool(workers, game.open_db)
+
+def read_map(mapname, mapnum, filename, mtime, pool=None):
+    '''Loads the compiled version of a map file if there is an up to date
+    one, otherwise parses the tmx file. See mapcompile.
+    '''
+    try:
+        data = mapcompile.load_compiled(mapname, mapnum, filename, mtime)
+    except (struct.error, ValueError):
+        # A damaged compiled map, the tmx file is still good
+        print >>sys.stderr, 'Compiled map for %s is corrupt, loading %s:' % (
+                mapname, filename)
+        traceback.print_exc()
+        data = None
+    if data == None:
+        data = parse_map(mapname, mapnum, filename, mtime, pool)
+    return data
+
+def parse_map(mapname, mapnum, filename, mtime, pool=None):
+    '''Reads everything from a map file that doesn't need OpenGL or game
+    state: map properties, tileset descriptions, decoded layer data, the
+    collision map and object layers. Layers are decoded on the workers of
+    pool if one is given.
+    '''
     # Open xml file
     tree = ElementTree.parse(util.resource.resource_path(filename))
     root = tree.getroot()
@@ -117,63 +360,131 @@ def load_map(mapname):
         raise MapException('Map orientation %s not supported. Orthogonal maps only' % root.get('orientation'))
 
     # Get map properties
-    width = int(root.get('width'))
-    height = int(root.get('height'))
-    tile_width = int(root.get('tilewidth'))
-    tile_height = int(root.get('tileheight'))
-
-    # Create map scene
-    map_scene = mapscene.MapScene(width, height, tile_width, tile_height)
+    data = MapData(mapname, mapnum, filename, mtime)
+    data.width = int(root.get('width'))
+    data.height = int(root.get('height'))
+    data.tile_width = int(root.get('tilewidth'))
+    data.tile_height = int(root.get('tileheight'))
 
-    # Load tilesets
-    tileset = TileSet()
+    # Tileset images are loaded later by build_map
     for tag in root.findall('tileset'):
-        tileset += load_tileset(tag)
+        data.tilesets.append(parse_tileset(tag))
+
+    # Decode layers
+    if pool != None:
+        data.layers = pool.map(parse_layer, root.findall('layer'))
+    else:
+        data.layers = [parse_layer(tag) for tag in root.findall('layer')]
+
+    # Build the collision map while the object layers are read
+    collision_map = None
+    for layer in data.layers:
+        if layer.name == 'collision':
+            args = (layer.data, layer.width, layer.height, data.tile_width,
+                    data.tile_height)
+            if pool != None:
+                collision_map = pool.apply(CollisionMap.from_data, *args)
+            else:
+                data.collision_map = CollisionMap.from_data(*args)
+
+    # Read object layers
+    for tag in root.findall('objectgroup'):
+        data.object_groups.append(parse_object_group(tag, data.tile_width, data.tile_height))
 
-    # Load layers
-    layers = dict()
-    for tag in root.findall('layer'):
-        layer = load_layer(tag, tileset, tile_width, tile_height)
-        layers[layer.id] = layer
+    if collision_map != None:
+        data.collision_map = collision_map.get()
+    return data
+
+def build_map(data, actor_rows=None):
+    '''Creates a new MapScene from parsed map data and populates it with
+    actors from the map file and the database. actor_rows are rows returned
+    by fetch_actors, they are queried if not given.
+    '''
+    # Create map scene
+    map_scene = mapscene.MapScene(data.width, data.height, data.tile_width, data.tile_height)
+    map_scene.mapnum = data.mapnum
+    # Use a fixed simulation step if the config asks for one
+    if game.config != None and game.config.has_option('Simulation', 'tick_rate'):
+        max_catchup = map_scene.max_catchup
+        if game.config.has_option('Simulation', 'max_catchup'):
+            max_catchup = game.config.getint('Simulation', 'max_catchup')
+        map_scene.set_tick_rate(game.config.getint('Simulation', 'tick_rate'),
+                max_catchup)
 
     # Load object layers
-    for tag in root.findall('objectgroup'):
-        layer = load_actor_layer(map_scene, tag, tile_width, tile_height)
+    layers = dict()
+    for group in data.object_groups:
+        layer = load_actor_layer(group)
         layers[layer.id] = layer
 
     #layers['actors'] = mapscene.ActorLayer('actors')
     # Load actors from database
-    load_from_db(layers['actors'], mapnum)
+    load_from_db(layers['actors'], data.mapnum, actor_rows)
+
+    # Simulate far away actors in less detail if the config has both bands
+    if game.config != None and game.config.has_option('Simulation', 'lod_near') \
+            and game.config.has_option('Simulation', 'lod_far'):
+        layers['actors'].lod.set_bands(game.config.getint('Simulation', 'lod_near'),
+                game.config.getint('Simulation', 'lod_far'))
+
+    # Headless maps have no use for tiles
+    if game.headless:
+        map_scene.init_headless(data.collision_map, layers['actors'])
+        return map_scene
+
+    load_tilesets(data)
+
+    # Load layers
+    for layer_data in data.layers:
+        layer = load_layer(layer_data, data.tileset, data.tile_width, data.tile_height)
+        layers[layer.id] = layer
 
-    map_scene.init_layers(layers['ground'], layers['fringe'], layers['over'], layers['collision'], layers['actors'])
+    map_scene.init_layers(layers['ground'], layers['fringe'], layers['over'], layers['collision'], layers['actors'], data.collision_map)
     return map_scene
-    
-def load_from_db(layer, mapnum):
+
+def load_tilesets(data):
+    # Tiles are kept with the parsed map so revisits don't slice the images
+    # again
+    if data.tileset == None:
+        tileset = TileSet()
+        for tileset_data in data.tilesets:
+            tileset += load_tileset(tileset_data)
+        data.tileset = tileset
+
+def fetch_actors(db, mapnum):
+    '''Returns a list of (row, properties) pairs for every actor in the
+    map. This takes two queries no matter how many actors there are, one for
+    the actors and one for all of their properties.
+    '''
     # Get all actors in the map
-    cursor = game.db.cursor()
-    cursor.execute('SELECT actornum, type, name, group_name, x, y, width,\
-            height FROM actor WHERE mapnum=?', (mapnum,))
+    rows = db.query('actors', (mapnum,))
 
-    # Load all actors
-    for row in cursor:
-        # Query for all actor properties
-        property_cursor = game.db.cursor()
-        property_cursor.execute('SELECT property, value FROM actor_property\
-            WHERE actornum=?', (row['actornum'],))
+    # Get the properties of every actor in the map at once
+    properties = {}
+    for actornum, name, value in db.query('actor_properties', (mapnum,)):
+        properties.setdefault(actornum, {})[name] = value
+
+    return [(row, properties.get(row['actornum'], {})) for row in rows]
 
-        # Make a dictionary of properties
-        properties = {}
-        for property_row in property_cursor:
-            properties[property_row['property']] = property_row['value']
+def load_from_db(layer, mapnum, rows=None):
+    if rows == None:
+        rows = fetch_actors(game.db, mapnum)
 
+    # Load all actors
+    for row, properties in rows:
         actor = factories[row['type']](properties)
         actor.name = row['name']
         actor.group = row['group_name']
         actor.position = (int(row['x']), int(row['y']))
         actor.size = (int(row['width']), int(row['height']))
+        actor.actornum = row['actornum']
+        actor.properties = properties
+        # Save changes from here on
+        if game.checkpoint != None:
+            game.checkpoint.track(actor)
         layer.add_actor(actor)
 
-def load_layer(tag, tileset, tile_width, tile_height):
+def parse_layer(tag):
     # Get layer properties
     name = tag.get('name')
     width = int(tag.get('width'))
@@ -184,65 +495,82 @@ def load_layer(tag, tileset, tile_width, tile_height):
     if child == None:
         raise MapException('No <data> tag in layer')
     # Load layer data
-    data = load_data(child)
-    # Construct layer
-    columns = []
-    for i in range(0, width):
-        row = []
-        columns.append(row)
-        for j in range(0, height):
-            index = j * width + i
-            tile = tileset[data[index] - 1]
-            if data[index] == 0:
-                tile = None
-            row.insert(0, cocos.tiles.RectCell(i, height - j - 1, tile_width, tile_height, None, tile))
-    return cocos.tiles.RectMapLayer(name, tile_width, tile_height, columns, (0,0,0), None)
-
-def load_data(tag):
+    return LayerData(name, width, height, load_data(child, width * height))
+
+def load_layer(layer_data, tileset, tile_width, tile_height):
+    # Cells are only created for the part of the layer around the view, so
+    # the layer just needs the gids
+    chunk_size = 16
+    if game.config != None and game.config.has_option('Graphics', 'chunk_size'):
+        chunk_size = game.config.getint('Graphics', 'chunk_size')
+    return chunked.ChunkedRectMapLayer(layer_data.name, tile_width, tile_height,
+            layer_data.grid, layer_data.width, layer_data.height, tileset,
+            chunk_size)
+
+def load_data(tag, count):
+    '''Decodes the gids in a layer's <data> tag. Handles base64 with zlib,
+    gzip or no compression, csv and plain <tile> tags. Raises a MapException
+    unless there are exactly count gids.
+    '''
     # Get data properties
     encoding = tag.get('encoding')
     compression = tag.get('compression')
-    data = tag.text
 
-    # Only base64 encoding supported as of now
-    if encoding != 'base64':
+    if encoding == 'base64':
+        decoded_data = base64.b64decode(tag.text)
+        if compression == 'zlib':
+            decoded_data = zlib.decompress(decoded_data)
+        elif compression == 'gzip':
+            # Tell zlib to expect a gzip header
+            decoded_data = zlib.decompress(decoded_data, 16 + zlib.MAX_WBITS)
+        elif compression != None:
+            raise MapException('Compression type %s not supported' % compression)
+        if len(decoded_data) != count * 4:
+            raise MapException('Expected %d tiles, found %d' % (count, len(decoded_data) / 4))
+        # decoded_data is little-endian uint32s, read them without copying
+        return tiledata.from_string(decoded_data, count)
+
+    if encoding == 'csv':
+        gids = [int(gid) for gid in tag.text.split(',')]
+    elif encoding == None:
+        gids = [int(child.get('gid')) for child in tag.findall('tile')]
+    else:
         raise MapException('Encoding type %s not supported' % encoding)
-    # Only zlib compression supported as of now
-    if compression != 'zlib':
-        raise MapException('Compression type %s not supported' % compression)
-
-    # Uncompress data
-    decoded_data = zlib.decompress(base64.b64decode(data))
-    # decoded_data is a string made of 64 bit integers now
-    # Turn that string into an array of 64 bit integers
-    # TODO: Use encoding 'L' or 'I' accordingly based upon CPU architecture.
-    #       32 bit = 'L' and 64 bit = 'I'
-    return array.array('I', decoded_data)
-
-def load_actor_layer(map_scene, tag, tile_width, tile_height):
-    name = tag.get('name')
-    width = int(tag.get('width'))
-    height = int(tag.get('height'))
-    layer = mapscene.ActorLayer(name)
+    if len(gids) != count:
+        raise MapException('Expected %d tiles, found %d' % (count, len(gids)))
+    return tiledata.from_list(gids)
+
+def parse_object_group(tag, tile_width, tile_height):
+    group = ObjectGroupData(tag.get('name'), int(tag.get('width')), int(tag.get('height')))
     for child in tag.findall('object'):
-        layer.add_actor(load_actor(map_scene, child, width, height, tile_width, tile_height))
-    return layer
+        group.objects.append(parse_object(child, group.width, group.height, tile_width, tile_height))
+    return group
 
-def load_actor(map_scene, tag, width, height, tile_width, tile_height):
+def parse_object(tag, width, height, tile_width, tile_height):
     # Get object properties
-    name = tag.get('name')
-    actor_type = tag.get('type')
-    x = int(tag.get('x'))
-    y = height * tile_height - int(tag.get('y')) - tile_height
-    width = int(tag.get('width'))
-    height = int(tag.get('height'))
-    rect = cocos.rect.Rect(x, y, width, height)
-    properties = dict()
+    obj = ObjectData(tag.get('name'), tag.get('type'))
+    obj.x = int(tag.get('x'))
+    obj.y = height * tile_height - int(tag.get('y')) - tile_height
+    obj.width = int(tag.get('width'))
+    obj.height = int(tag.get('height'))
     for p in tag.find('properties'):
-        properties[p.get('name')] = p.get('value')
-    actor = factories[actor_type](properties)
-    actor.name = name
-    actor.position = (x, y)
-    actor.size = (width, height)
-    return actor
+        obj.properties[p.get('name')] = p.get('value')
+    return obj
+
+def load_actor_layer(group):
+    # Optionally keep component fields in column arrays for the systems
+    columns = False
+    if game.config != None and game.config.has_option('Simulation', 'columns'):
+        columns = game.config.getboolean('Simulation', 'columns')
+    layer = mapscene.ActorLayer(group.name, columns=columns)
+    for obj in group.objects:
+        layer.add_actor(load_actor(obj))
+    return layer
 
+def load_actor(obj):
+    # Factories are free to keep the dictionary so hand out a copy
+    actor = factories[obj.type](dict(obj.properties))
+    actor.name = obj.name
+    actor.position = (obj.x, obj.y)
+    actor.size = (obj.width, obj.height)
+    return actor
@@ -0,0 +1,64 @@
+import threading
+from multiprocessing.pool import ThreadPool
+
+class LoaderPool(object):
+    '''Pool of worker threads for the parts of loading a map that don't
+    need OpenGL: decompressing layers, building the collision map and
+    fetching actor rows. zlib and sqlite let go of the GIL while they work,
+    so this overlaps with the main thread parsing the rest of the map.
+
+    Threads rather than processes since the results are big buffers and
+    Python objects that would have to be pickled on the way back. Workers
+    each open their own database connections with connect(filename) since
+    sqlite connections can't be shared between threads.
+    '''
+    def __init__(self, workers, connect):
+        self.workers = workers
+        self.connect = connect
+        self.pool = ThreadPool(workers)
+        self.local = threading.local()
+
+    def apply(self, func, *args):
+        '''Runs func(*args) on a worker. Returns an AsyncResult.'''
+        return self.pool.apply_async(func, args)
+
+    def map(self, func, iterable):
+        '''Like the builtin map, but spread over the workers.'''
+        return self.pool.map(func, iterable)
+
+    def query(self, db_filename, func, *args):
+        '''Runs func(db, *args) on a worker, where db is the worker's own
+        connection to db_filename. Returns an AsyncResult.
+        '''
+        return self.pool.apply_async(self._query, (db_filename, func, args))
+
+    def _query(self, db_filename, func, args):
+        connections = getattr(self.local, 'connections', None)
+        if connections == None:
+            connections = self.local.connections = {}
+        db = connections.get(db_filename)
+        if db == None:
+            db = connections[db_filename] = self.connect(db_filename)
+        return func(db, *args)
+
+    def close(self):
+        '''Closes the workers' database connections and stops the workers.'''
+        # sqlite only lets a connection be closed by the thread that opened
+        # it, so each worker gets a task that closes its own. The tasks wait
+        # for each other so that no worker ends up with two of them.
+        self._closers = 0
+        self._closers_started = threading.Condition()
+        for i in range(self.workers):
+            self.pool.apply_async(self._close_connections)
+        self.pool.close()
+        self.pool.join()
+
+    def _close_connections(self):
+        for db in getattr(self.local, 'connections', {}).itervalues():
+            db.close()
+        self.local.connections = {}
+        with self._closers_started:
+            self._closers += 1
+            self._closers_started.notify_all()
+            while self._closers < self.workers:
+                self._closers_started.wait()
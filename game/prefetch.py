@@ -0,0 +1,70 @@
+import sys
+import threading
+import traceback
+import Queue
+import pyglet
+
+class MapPrefetcher(object):
+    '''Loads maps on a worker thread before they are needed. The worker
+    calls load(db, mapname) with a database connection of its own, opened
+    with connect(filename), since sqlite connections can't be shared between
+    threads. Whatever load returns is handed to finish(result) on the main
+    thread by poll, which is where anything that needs the OpenGL context has
+    to happen.
+    '''
+    def __init__(self, load, finish, connect):
+        self.load = load
+        self.finish = finish
+        self.connect = connect
+        self.requests = Queue.Queue()
+        self.results = Queue.Queue()
+        # Names of maps that have been requested but not finished
+        self.pending = set()
+        self.thread = None
+
+    def prefetch(self, db_filename, mapname):
+        '''Queues the named map for loading. Maps that are already queued are
+        ignored.
+        '''
+        if mapname in self.pending:
+            return
+
+        if self.thread == None:
+            self.thread = threading.Thread(target=self._run, name='MapPrefetcher')
+            self.thread.daemon = True
+            self.thread.start()
+            pyglet.clock.schedule_interval(self.poll, 0.1)
+
+        self.pending.add(mapname)
+        self.requests.put((db_filename, mapname))
+
+    def poll(self, dt=0):
+        '''Finishes every map that the worker is done with. Must be called
+        from the main thread.
+        '''
+        while True:
+            try:
+                mapname, result = self.results.get_nowait()
+            except Queue.Empty:
+                return
+
+            self.pending.discard(mapname)
+            if result != None:
+                self.finish(result)
+
+    def _run(self):
+        db = None
+        db_filename = None
+        while True:
+            filename, mapname = self.requests.get()
+            try:
+                if filename != db_filename:
+                    db = self.connect(filename)
+                    db_filename = filename
+                result = self.load(db, mapname)
+            except Exception:
+                # Not fatal, the map will be loaded normally when it's needed
+                print >>sys.stderr, 'Prefetching %s failed:' % mapname
+                traceback.print_exc()
+                result = None
+            self.results.put((mapname, result))
@@ -0,0 +1,210 @@
+'''Per-frame timing of the game's subsystems. Timing scopes are installed by
+wrapping the timed functions when the profiler is enabled and removed again
+when it is disabled, so a disabled profiler costs nothing at all.
+
+    from game.profiler import profiler
+    profiler.enable()
+    ...
+    profiler.stats()['MapScene.update']  # (p50, p99, last) in seconds
+    profiler.dump('profile.json')
+
+Times are inclusive, MapScene.update includes physics for example. Frames
+end with each clock tick, or when end_frame is called for simulations that
+don't run the pyglet clock.
+'''
+import json
+import time
+import collections
+import pyglet
+
+def percentile(values, fraction):
+    '''Returns the value at the given fraction of the sorted values.'''
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def default_scopes():
+    '''Returns (target, attribute, scope name) for every function that is
+    timed by default.
+    '''
+    from map import mapscene, physics, chunked
+    from map.collision import CollisionMap
+    from actor import component
+
+    scopes = [
+        (mapscene.MapScene, 'update', 'MapScene.update'),
+        (mapscene.ActorLayer, 'update', 'ActorLayer.update'),
+        (mapscene.ActorLayer, 'resolve_triggers', 'triggers'),
+        (physics.PhysicsSystem, 'step', 'physics'),
+        (CollisionMap, 'collides', 'collision'),
+        (physics, 'collides', 'collision'),
+        (mapscene.MapScene, 'visit', 'render'),
+        (chunked.ChunkedRectMapLayer, 'draw', 'render.tiles'),
+    ]
+    # One scope per component type
+    classes = component.Component.__subclasses__()
+    while classes:
+        cls = classes.pop()
+        classes.extend(cls.__subclasses__())
+        if cls.component_type != None:
+            scopes.append((cls, 'update', 'component.' + cls.component_type))
+    return scopes
+
+class Profiler(object):
+    '''Collects the time spent in named scopes per frame. The last frames
+    frames are kept for every scope.
+    '''
+    def __init__(self, frames=300):
+        self.frames = frames
+        self.enabled = False
+        # Scope name -> seconds spent in it this frame
+        self.current = {}
+        # Scope name -> deque of per-frame totals
+        self.history = {}
+        # (target, attribute, original or None if it was inherited)
+        self._installed = []
+        self._clock = time.time
+        # ProfilerOverlay drawn by MapScene, see show_overlay
+        self.overlay = None
+
+    def enable(self, scopes=None):
+        '''Starts timing the given scopes, see default_scopes.'''
+        if self.enabled:
+            return
+        if scopes == None:
+            scopes = default_scopes()
+        for target, attribute, name in scopes:
+            self._install(target, attribute, name)
+        pyglet.clock.schedule(self._on_tick)
+        self.enabled = True
+
+    def disable(self):
+        '''Stops timing and puts the original functions back. Collected
+        stats are kept.
+        '''
+        if not self.enabled:
+            return
+        pyglet.clock.unschedule(self._on_tick)
+        for target, attribute, original in reversed(self._installed):
+            if original == None:
+                delattr(target, attribute)
+            else:
+                setattr(target, attribute, original)
+        self._installed = []
+        self.enabled = False
+
+    def show_overlay(self):
+        if self.overlay == None:
+            self.overlay = ProfilerOverlay(self)
+
+    def hide_overlay(self):
+        if self.overlay != None:
+            self.overlay.delete()
+            self.overlay = None
+
+    def reset(self):
+        self.current.clear()
+        self.history.clear()
+
+    def _install(self, target, attribute, name):
+        # Wrap what the attribute currently resolves to, but remember
+        # whether it was defined on target itself or inherited so that
+        # disabling puts things back exactly
+        if isinstance(target, type):
+            original = target.__dict__.get(attribute)
+            func = getattr(target, attribute).im_func
+        else:
+            original = getattr(target, attribute)
+            func = original
+        # A subclass may inherit a function that is already wrapped
+        func = getattr(func, 'profiled_function', func)
+        add = self.add
+        clock = self._clock
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                add(name, clock() - start)
+        timed.__name__ = func.__name__
+        timed.__doc__ = func.__doc__
+        timed.profiled_function = func
+        setattr(target, attribute, timed)
+        self._installed.append((target, attribute, original))
+
+    def add(self, name, elapsed):
+        '''Adds elapsed seconds to the named scope for this frame.'''
+        self.current[name] = self.current.get(name, 0.0) + elapsed
+
+    def _on_tick(self, dt):
+        self.end_frame(dt)
+
+    def end_frame(self, dt=None):
+        '''Moves this frame's totals into the history. dt is recorded as the
+        frame scope.
+        '''
+        if dt != None:
+            self.current['frame'] = dt
+        for name in self.current:
+            if name not in self.history:
+                self.history[name] = collections.deque(maxlen=self.frames)
+        # Scopes that weren't entered this frame took no time
+        for name, history in self.history.items():
+            history.append(self.current.get(name, 0.0))
+        self.current.clear()
+
+    def stats(self):
+        '''Returns scope name -> (p50, p99, last) in seconds.'''
+        return dict((name, (percentile(history, 0.5), percentile(history, 0.99),
+            history[-1])) for name, history in self.history.items() if history)
+
+    def report(self):
+        '''Returns the stats as a printable table, slowest p99 first.'''
+        stats = self.stats()
+        lines = ['%-24s %8s %8s %8s' % ('scope', 'p50 ms', 'p99 ms', 'last ms')]
+        for name, (p50, p99, last) in sorted(stats.items(), key=lambda item: -item[1][1]):
+            lines.append('%-24s %8.3f %8.3f %8.3f' % (name, p50 * 1000, p99 * 1000,
+                last * 1000))
+        return '\n'.join(lines)
+
+    def dump(self, filename):
+        '''Writes the stats and the per-frame history of every scope to a
+        JSON file.
+        '''
+        stats = self.stats()
+        f = open(filename, 'w')
+        try:
+            json.dump({'frames': self.frames,
+                'stats': dict((name, {'p50': p50, 'p99': p99, 'last': last})
+                    for name, (p50, p99, last) in stats.items()),
+                'history': dict((name, list(history))
+                    for name, history in self.history.items())},
+                f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+
+class ProfilerOverlay(object):
+    '''Draws the profiler's report in the corner of the window. The text is
+    only rebuilt a few times a second.
+    '''
+    def __init__(self, profiler, interval=0.5):
+        self.profiler = profiler
+        self.label = pyglet.text.Label('', font_name='Courier New', font_size=9,
+                x=5, y=5, anchor_y='bottom', multiline=True, width=420,
+                color=(255, 255, 255, 255))
+        self.interval = interval
+        pyglet.clock.schedule_interval(self.refresh, interval)
+
+    def refresh(self, dt=0):
+        self.label.text = self.profiler.report()
+
+    def draw(self):
+        self.label.draw()
+
+    def delete(self):
+        pyglet.clock.unschedule(self.refresh)
+        self.label.delete()
+
+# There is only one frame to time at once
+profiler = Profiler()
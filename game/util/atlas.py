@@ -0,0 +1,86 @@
+'''Process wide texture atlas. Tileset and animation images are packed into a
+few large shared textures so that tiles from different tilesets can be drawn
+without switching textures, and so that each image is only uploaded once no
+matter how many maps use it. Each packed image gets a gutter of its own edge
+pixels around it so that filtering at its edges doesn't pick up its
+neighbours in the atlas.
+'''
+from ctypes import byref
+import pyglet
+import pyglet.image.atlas
+from pyglet.gl import *
+
+# Largest atlas texture to ask for. Smaller if the driver can't do it.
+ATLAS_SIZE = 2048
+# Pixels of repeated edge around each image in the atlas
+GUTTER = 1
+
+_bin = None
+# Resource name -> image in the atlas
+_images = {}
+# Ids of textures that already have their wrap mode set
+_clamped = set()
+
+def _get_bin():
+    global _bin
+    if _bin == None:
+        max_size = GLint()
+        glGetIntegerv(GL_MAX_TEXTURE_SIZE, byref(max_size))
+        size = min(ATLAS_SIZE, max_size.value)
+        _bin = pyglet.image.atlas.TextureBin(size, size)
+    return _bin
+
+def image(name):
+    '''Loads a resource image into the shared atlas and returns its region.
+    Images that don't fit in an atlas texture get a texture of their own.
+    Loading the same name again returns the same region.
+    '''
+    if name in _images:
+        return _images[name]
+
+    f = pyglet.resource.file(name)
+    try:
+        img = pyglet.image.load(name, file=f)
+    finally:
+        f.close()
+    try:
+        padded = _get_bin().add(pad(img, GUTTER))
+        region = padded.get_region(GUTTER, GUTTER, img.width, img.height)
+    except pyglet.image.atlas.AllocatorException:
+        region = img.get_texture()
+    clamp(region.texture)
+    _images[name] = region
+    return region
+
+def pad(img, border):
+    '''Returns a copy of the image with border pixels added on every side,
+    each a copy of the nearest edge pixel.
+    '''
+    pitch = img.width * 4
+    data = img.get_data('RGBA', pitch)
+    rows = []
+    for y in range(0, len(data), pitch):
+        row = data[y:y + pitch]
+        rows.append(row[:4] * border + row + row[-4:] * border)
+    rows = rows[:1] * border + rows + rows[-1:] * border
+    return pyglet.image.ImageData(img.width + 2 * border,
+            img.height + 2 * border, 'RGBA', ''.join(rows))
+
+def clamp(texture):
+    '''Sets texture clamping to avoid mis-rendering subpixel edges. This is
+    only done once per texture.
+    Borrowed from cocos2d tiles.py
+    '''
+    if texture.id in _clamped:
+        return
+
+    glBindTexture(texture.target, texture.id)
+    glTexParameteri(texture.target, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+    glTexParameteri(texture.target, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+    _clamped.add(texture.id)
+
+def textures():
+    '''Returns the atlas textures created so far.'''
+    if _bin == None:
+        return []
+    return [atlas.texture for atlas in _bin.atlases]